@@ -0,0 +1,87 @@
+## Run on each machine that should process court books (e.g. as a Windows task scheduler task, like "CTP Watcher") ##
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from supporting_files.job_queue_class import JobQueue
+from supporting_files.log_sink_class import LOG_SINK
+
+QUEUE_LOCATION = r"\\V0050\05_CTP_chronology\run_scripts\queue"
+SCRIPT_TO_RUN = r"\\V0050\05_CTP_chronology\07_main.py"
+WORKSPACE_LOCATION = os.path.join(tempfile.gettempdir(), "ctp_workspaces")  # Local disk; one outputs folder per job
+STATE_LOCATION = os.path.join(WORKSPACE_LOCATION, "state")  # This machine's entry state (SQLite isn't shared over the network)
+WORKER_LOG = rf"\\V0050\05_CTP_chronology\run_scripts\workers\{socket.gethostname()}.log"
+SCRIPT_LOG = rf"\\V0050\05_CTP_chronology\run_scripts\workers\{socket.gethostname()}_07_main.log"
+PROGRESS_LOG = r"\\V0050\05_CTP_chronology\run_scripts\progress.log"
+POLL_INTERVAL = 10  # Seconds between looks at the queue when it is empty
+LEASE_CHECK_INTERVAL = 5  # Seconds between checks that this worker still holds the running job's lease
+
+def log(message):
+    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+    LOG_SINK.write(WORKER_LOG, f"{timestamp} {message}\n")
+
+def log_progress(message):
+    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+    LOG_SINK.write(PROGRESS_LOG, f"{timestamp} {message}\n")
+
+def run_job(queue, path, record):
+    """Runs 07_main.py for one claimed court book in its own outputs folder, then completes or fails the job."""
+    court_book_id = record["court_book_id"]
+    workspace = os.path.join(WORKSPACE_LOCATION, court_book_id)
+    outputs = os.path.join(workspace, "outputs")
+    os.makedirs(outputs, exist_ok=True)
+    log(f"Claimed court book {court_book_id} (attempt {record['attempts']}); outputs in {outputs}")
+    log_progress(f"Worker {queue.worker_id} started court book {court_book_id}.")
+
+    with queue.lease(path) as lost, open(SCRIPT_LOG, "a", encoding="utf-8") as log_target:
+        process = subprocess.Popen(
+            ["python", SCRIPT_TO_RUN, "--outputs", outputs, "--state", STATE_LOCATION, court_book_id],
+            stdout=log_target,
+            stderr=log_target
+        )
+        try:
+            while process.poll() is None:
+                if lost.wait(timeout=LEASE_CHECK_INTERVAL):
+                    process.kill()
+                    process.wait()
+                    log(f"Lease on court book {court_book_id} was lost; stopped its run so another worker can take it.")
+                    return
+        except KeyboardInterrupt:
+            process.kill()
+            process.wait()
+            queue.fail(path, "worker stopped")
+            raise
+
+    if process.returncode == 0:
+        queue.complete(path, return_code=0)
+        shutil.rmtree(workspace, ignore_errors=True)
+        log(f"Court book {court_book_id} done.")
+    else:
+        # The workspace is kept, so a retry on this machine resumes from the saved responses
+        queue.fail(path, f"07_main.py exited with return code {process.returncode}")
+        log(f"Court book {court_book_id} failed with return code {process.returncode}.")
+
+def worker():
+    os.makedirs(os.path.dirname(WORKER_LOG), exist_ok=True)
+    queue = JobQueue(QUEUE_LOCATION)
+    log(f"Worker {queue.worker_id} started on queue {QUEUE_LOCATION}.")
+    print(f"Worker {queue.worker_id} waiting for jobs in: {QUEUE_LOCATION}")
+    while True:
+        job = queue.claim()
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+        try:
+            run_job(queue, *job)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            log(f"Error running job {job[0]}: {e}")
+            queue.fail(job[0], e)
+
+
+if __name__ == "__main__":
+    worker()
@@ -1,25 +1,40 @@
 ## REMEMBER!! Start the windows task scheduler task "CTP Watcher" to run this script ##
 import hashlib
+import os
+import queue
+import threading
 import time
 import subprocess
 from datetime import datetime
+from supporting_files.log_sink_class import LOG_SINK
+from supporting_files.job_queue_class import JobQueue
+from supporting_files.court_book_csv import read_court_book_ids
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Optional: without watchdog the watcher falls back to stat polling
+    Observer = None
+    FileSystemEventHandler = object
 
 WATCH_FILE = r"\\V0050\05_CTP_chronology\00_courtbooks_to_get.csv"
 SCRIPT_TO_RUN = r"\\V0050\05_CTP_chronology\07_main.py"
 WATCHER_LOG = r"\\V0050\05_CTP_chronology\watcher.log"
 SCRIPT_LOG = r"\\V0050\05_CTP_chronology\07_main.log"
 PROGRESS_LOG = r"\\V0050\05_CTP_chronology\run_scripts\progress.log"
-POLL_INTERVAL = 60  # seconds
+QUEUE_LOCATION = r"\\V0050\05_CTP_chronology\run_scripts\queue"  # Shared job queue read by 00_queue_worker.py
+POLL_INTERVAL = 2  # seconds between stat checks (change notifications wake the watcher sooner)
+DEBOUNCE_SECONDS = 3  # file must be unchanged for this long before a run is queued
+MAX_CONCURRENT_RUNS = 1  # runs share the outputs/ folder, so keep this at 1 unless outputs are isolated
+USE_JOB_QUEUE = False  # True = add each listed court book to the shared job queue for 00_queue_worker.py instead of running 07_main.py here
 
 def log_progress(message):
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open(PROGRESS_LOG, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+    LOG_SINK.write(PROGRESS_LOG, f"{timestamp} {message}\n")
 
 def log(message):
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open(WATCHER_LOG, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+    LOG_SINK.write(WATCHER_LOG, f"{timestamp} {message}\n")
 
 def file_hash(path):
     try:
@@ -28,37 +43,152 @@ def file_hash(path):
     except FileNotFoundError:
         return None
 
+def enqueue_court_books(csv_file, queue_location=QUEUE_LOCATION):
+    """Adds a job for each court book ID in the CSV (first column, header skipped). Returns the IDs added."""
+    court_book_ids = read_court_book_ids(csv_file)
+    queue = JobQueue(queue_location)
+    return [court_book_id for court_book_id in court_book_ids if queue.enqueue(court_book_id)]
+
+def file_signature(path):
+    """Cheap change check: (modified time, size) from a single stat call, or None if missing."""
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+class WatchFileHandler(FileSystemEventHandler):
+    """Wakes the watcher when the watched file is created, modified or replaced."""
+
+    def __init__(self, wake_event):
+        super().__init__()
+        self.wake_event = wake_event
+        self.watch_name = os.path.normcase(os.path.basename(WATCH_FILE))
+
+    def on_any_event(self, event):
+        paths = [getattr(event, "src_path", ""), getattr(event, "dest_path", "")]
+        if any(os.path.normcase(os.path.basename(path)) == self.watch_name for path in paths if path):
+            self.wake_event.set()
+
+
+class RunQueue:
+    """Queues pipeline runs and executes them on MAX_CONCURRENT_RUNS worker threads.
+
+    At most one run is kept waiting: 07_main.py reads the CSV when it starts, so a single
+    pending run picks up every change made while another run was in progress.
+    """
+
+    def __init__(self, workers=MAX_CONCURRENT_RUNS):
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self):
+        with self.lock:
+            if self.pending:
+                log("Run already queued; change will be picked up by it.")
+                return
+            self.pending += 1
+        self.jobs.put(datetime.now())
+
+    def _worker(self):
+        while True:
+            queued_at = self.jobs.get()
+            with self.lock:
+                self.pending -= 1
+            self._run(queued_at)
+            self.jobs.task_done()
+
+    def _run(self, queued_at):
+        wait = (datetime.now() - queued_at).total_seconds()
+        try:
+            log(f"Running 07_main.py (output -> 07_main.log), queued {wait:.0f}s")
+            log_progress("Running main processing script.")
+            with open(SCRIPT_LOG, "a", encoding="utf-8") as log_target:
+                process = subprocess.Popen(
+                    ["python", SCRIPT_TO_RUN],
+                    stdout=log_target,
+                    stderr=log_target
+                )
+                log("Script started successfully.")
+                log_progress("Script launched successfully.")
+                return_code = process.wait()  # Block this worker so runs never overlap beyond MAX_CONCURRENT_RUNS
+            log(f"Script finished with return code {return_code}.")
+        except Exception as e:
+            log(f"Error starting script: {e}")
+            log_progress(f"ERROR: Could not start script - {e}")
+
+
+def start_observer(wake_event):
+    """Starts a change-notification observer on the watch folder if watchdog is available."""
+    if Observer is None:
+        log("watchdog not installed; using stat polling only.")
+        return None
+    try:
+        observer = Observer()
+        observer.schedule(WatchFileHandler(wake_event), os.path.dirname(WATCH_FILE), recursive=False)
+        observer.start()
+        log("Change notifications enabled.")
+        return observer
+    except Exception as e:
+        log(f"Change notifications unavailable ({e}); using stat polling only.")
+        return None
+
+def wait_until_stable(signature):
+    """Waits until the file's signature has not changed for DEBOUNCE_SECONDS; returns the settled signature."""
+    while True:
+        time.sleep(DEBOUNCE_SECONDS)
+        current = file_signature(WATCH_FILE)
+        if current == signature:
+            return current
+        signature = current
+
 def watcher():
     log("Watcher started.")
 
         # Clear progress log at the start
     with open(PROGRESS_LOG, "w", encoding="utf-8") as f:
         f.write("")
-        
+
     log_progress("Watcher service started and monitoring file.")
     print(f"Watching for changes to: {WATCH_FILE}")
+
+    wake_event = threading.Event()
+    observer = start_observer(wake_event)
+    runs = RunQueue()
+
+    last_signature = file_signature(WATCH_FILE)
     last_hash = file_hash(WATCH_FILE)
-    while True:
-        time.sleep(POLL_INTERVAL)
-        current_hash = file_hash(WATCH_FILE)
-        if current_hash and current_hash != last_hash:
-            log("Change detected. Launching script.")
-            log_progress("Change detected in watch file. Starting script.")
-            try:
-                log("Running 07_main.py (output -> 07_main.log)")
-                log_progress("Running main processing script.")
-                with open(SCRIPT_LOG, "a", encoding="utf-8") as log_target:
-                    subprocess.Popen(
-                        ["python", SCRIPT_TO_RUN],
-                        stdout=log_target,
-                        stderr=log_target
-                    )
-                log("Script started successfully.")
-                log_progress("Script launched successfully.")
-            except Exception as e:
-                log(f"Error starting script: {e}")
-                log_progress(f"ERROR: Could not start script - {e}")
-            last_hash = current_hash
+    try:
+        while True:
+            wake_event.wait(timeout=POLL_INTERVAL)
+            wake_event.clear()
+
+            current_signature = file_signature(WATCH_FILE)
+            if current_signature is None or current_signature == last_signature:
+                continue
+
+            # Let the writer finish, then confirm the content really changed before queuing a run
+            current_signature = wait_until_stable(current_signature)
+            current_hash = file_hash(WATCH_FILE)
+            last_signature = current_signature
+            if current_hash and current_hash != last_hash:
+                if USE_JOB_QUEUE:
+                    added = enqueue_court_books(WATCH_FILE)
+                    log(f"Change detected. Queued court books for workers: {', '.join(added) or 'none new'}")
+                    log_progress(f"Change detected in watch file. {len(added)} court book(s) queued for workers.")
+                else:
+                    log("Change detected. Queuing script run.")
+                    log_progress("Change detected in watch file. Starting script.")
+                    runs.submit()
+                last_hash = current_hash
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
 
 
 if __name__ == "__main__":
@@ -1,65 +1,44 @@
 import pandas as pd
-import csv
-import glob
-import os
 from datetime import datetime
 from supporting_files.webapp_class import APIClient
-from bs4 import BeautifulSoup
+from supporting_files.chunker_class import TextChunker
+from supporting_files.store_class import BookStore, EntryState
+from supporting_files.html_text_class import HTMLTextExtractor
+from supporting_files.metrics_class import METRICS
+from supporting_files.log_sink_class import LOG_SINK
+from supporting_files.court_book_csv import read_court_book_ids
 import uuid
+import time
+import threading
 import concurrent.futures
 
 # Constants
 BASE_URL = "http://sydwebdev139:8080"
 LOGIN_PAGE_URL = f"{BASE_URL}/sparke/authed/user.action?cmd=welcome"
 LOGIN_URL = f"{BASE_URL}/sparke/authed/j_security_check"
-CSV_FILE = '00_courtbooks_to_get.csv'
 OUTPUT_LOCATION = 'outputs/'
 PROGRESS_LOG = r"\\V0050\05_CTP_chronology\run_scripts\progress.log"
+MAX_BOOK_WORKERS = 6  # Court books extracted at the same time over the shared session
+BOOK_TIME_BUDGET = 30  # Seconds each book may take, counted from when its extraction starts
+TOKEN_LIMIT = 3500  # Max tokens per part sent to the LLM
+STATE_LOCATION = 'state/'  # Per-book entry hashes and responses, kept across runs (outside outputs/)
 
 def log_progress(message):
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open(PROGRESS_LOG, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+    LOG_SINK.write(PROGRESS_LOG, f"{timestamp} {message}\n")
 
 
-def extract_first_line(text, max_length=80):
-    """Extracts the first non-empty line of text from <p> tags in an HTML string and truncates it."""
-    if not text:
-        return "-"
+def parse_data(data, book_item_lookup, previous_state=None):
+    """Processes API response into structured rows for CSV output, including book item descriptions.
 
-    # Parse the HTML content
-    soup = BeautifulSoup(text, "html.parser")
-
-    # Find all <p> elements
-    paragraphs = soup.find_all("p")
-
-    # Iterate through paragraphs and return the first non-empty text
-    for p in paragraphs:
-        clean_text = p.get_text(strip=True)  # Remove leading/trailing spaces
-        if clean_text:  # Skip empty paragraphs
-            return (clean_text[:max_length] + "...") if len(clean_text) > max_length else clean_text
-    
-    return "-"
-
-def split_text_into_parts(text, num_parts):
-    """Splits text into roughly equal parts, keeping sentence integrity if possible."""
-    words = text.split()  # Tokenize by words
-    split_size = len(words) // num_parts  # Words per part
-
-    parts = []
-    for i in range(num_parts):
-        start = i * split_size
-        end = None if i == num_parts - 1 else (i + 1) * split_size
-        part_text = " ".join(words[start:end])  # Join words back into a string
-        parts.append(part_text.strip())  # Remove leading/trailing spaces
-    
-    return parts
-
-def parse_data(data, book_item_lookup):
-    """Processes API response into structured rows for CSV output, including book item descriptions."""
+    previous_state ({line_id: (content_hash, [part responses])} from EntryState) lets unchanged entries
+    carry their last responses forward in "Previous Response" so stage 2 can skip them.
+    """
     rows = []
     index_counter = 0
-    TOKEN_LIMIT = 3500  # Max tokens per part
+    chunker = TextChunker(TOKEN_LIMIT)
+    previous_state = previous_state or {}
+    reused = 0
 
     for entry in data:
         handwritten = entry.get("handwritten", "").strip().lower()
@@ -75,14 +54,15 @@ def parse_data(data, book_item_lookup):
         except Exception:
             entry_date = "Invalid timestamp"
 
-        entry_original = APIClient.clean_html(entry.get("entryOriginal", ""))
-        entry_modified = APIClient.clean_html(entry.get("entryFinal", ""))
-        first_line = extract_first_line(entry.get("entryFinal", ""))
-        word_count = len(entry_original.split())  # Count words
-        token_count = int(round(word_count * 1.3))  # Estimate token count
+        # One parse per HTML field gives the text, first paragraph and word count together
+        entry_original, _, word_count = APIClient.extract_html(entry.get("entryOriginal", ""))
+        entry_modified, first_paragraph, _ = APIClient.extract_html(entry.get("entryFinal", ""))
+        first_line = HTMLTextExtractor.first_line(first_paragraph)
+        token_count = chunker.count_tokens(entry_original) if word_count else 0
 
         # Generate a unique ID for the original entry
         unique_id = str(uuid.uuid4())
+        content_hash = EntryState.content_hash(entry.get("entryOriginal", ""))
 
         if handwritten == "true":
             rows.append({
@@ -102,14 +82,23 @@ def parse_data(data, book_item_lookup):
                 "Handwritten": handwritten,
                 "Relevant": relevant,
                 "Entry Description": first_line if first_line.isupper() else "-",
+                "Content Hash": content_hash,
+                "Previous Response": None,
                 "Response": "** handwritten **"
             })
             index_counter += 1
             continue
 
         if handwritten == "false" and relevant == "Relevant":
-            num_parts = max(1, -(-token_count // TOKEN_LIMIT))  # Equivalent to math.ceil(token_count / TOKEN_LIMIT)
-            entry_parts = split_text_into_parts(entry_original, num_parts)
+            entry_parts = chunker.split(entry_original)  # Sentence-aligned parts, each within TOKEN_LIMIT
+            num_parts = len(entry_parts)
+
+            # Reuse the last responses if the entry text is unchanged and splits into the same parts
+            previous_hash, previous_responses = previous_state.get(id, (None, None))
+            if previous_hash != content_hash or not previous_responses or len(previous_responses) != num_parts:
+                previous_responses = [None] * num_parts
+            else:
+                reused += 1
 
             for part_index, part_text in enumerate(entry_parts, start=1):
                 rows.append({
@@ -129,85 +118,190 @@ def parse_data(data, book_item_lookup):
                     "Handwritten": handwritten,
                     "Relevant": relevant,
                     "Entry Description": first_line if first_line.isupper() else "-",
+                    "Content Hash": content_hash,
+                    "Previous Response": previous_responses[part_index - 1],
                     "Response": None
                 })
                 index_counter += 1
 
+    if previous_state:
+        print(f"{reused} unchanged entries will reuse their previous responses")
     return rows
 
-def save_to_csv(rows, court_book_id):
-    """Saves processed data to a CSV file."""
-    filename = os.path.join(OUTPUT_LOCATION, f"{court_book_id}_courtbook.csv")
+def save_to_store(rows, court_book_id):
+    """Saves processed data to the book's intermediate store and returns the saved DataFrame."""
     df = pd.DataFrame(rows)
     
     # Reorder columns to include the new field
     cols = ["Index", "Unique ID", "Part", "First Line", "Handwritten", "Relevant",
             "Court Book ID", "Book Item ID","Line ID", "Book Item Description", 
-            "Entry Date", "PromptID", "Entry_Original", "Entry_Modified","Token Count", "Entry Description"]
+            "Entry Date", "PromptID", "Entry_Original", "Entry_Modified","Token Count", "Entry Description",
+            "Content Hash", "Previous Response"]
     
     df = df[cols]
-    df.to_csv(filename, index=False)
-    print(f"CSV file successfully saved: {filename}")
-
-def process_court_book(client, court_book_id):
-    """Fetches court book data, retrieves book item descriptions, and writes to CSV."""
-    
-    # Fetch book item descriptions
-    book_item_lookup = fetch_book_items(client, court_book_id)
-    
-    # Fetch chronology data
-    response_data = client.fetch_api_data(f"/sparke/api/v0/books/{court_book_id}/chronology/")
-    
-    # Parse data with book item lookup
-    rows = parse_data(response_data, book_item_lookup)
-    
-    # Save output
-    save_to_csv(rows, court_book_id)
-
-def fetch_book_items(client, court_book_id):
+    with BookStore(OUTPUT_LOCATION, court_book_id) as store:
+        store.write_frame("courtbook", df)
+        store.journal_clear()  # Stage 2 results from an earlier extract no longer apply
+    print(f"Court book {court_book_id} saved to store ({len(df)} rows)")
+    return df
+
+def time_left(deadline, court_book_id):
+    """Seconds until the book's deadline (time.monotonic()); raises TimeoutError once it has passed."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError(f"Court book {court_book_id} ran past its {BOOK_TIME_BUDGET}s budget")
+    return remaining
+
+def process_court_book(client, court_book_id, deadline=None, claim_save=None):
+    """Fetches court book data, retrieves book item descriptions, and writes to the book store. Returns the saved DataFrame.
+
+    deadline (a time.monotonic() value, default BOOK_TIME_BUDGET from now) bounds the whole book: requests
+    get only the time remaining, and a book past its deadline raises TimeoutError without saving anything.
+    claim_save, if given, is called just before saving; False means the caller has given up on the book
+    and the results are discarded the same way.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + BOOK_TIME_BUDGET
+
+    # Fetch book item descriptions and chronology data at the same time, within the book's remaining time
+    timeout = time_left(deadline, court_book_id)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        items_future = executor.submit(fetch_book_items, client, court_book_id, timeout)
+        chronology_future = executor.submit(
+            client.fetch_api_data_with_validators, f"/sparke/api/v0/books/{court_book_id}/chronology/", timeout=timeout
+        )
+        book_item_lookup = items_future.result()
+        response_data, validators, _ = chronology_future.result()
+    time_left(deadline, court_book_id)
+
+    # Parse data with book item lookup, carrying forward responses for unchanged entries
+    previous_state = EntryState(STATE_LOCATION, court_book_id).load()
+    rows = parse_data(response_data, book_item_lookup, previous_state)
+
+    # Late results are dropped rather than saved over what stage 2 may read
+    time_left(deadline, court_book_id)
+    if claim_save is not None and not claim_save():
+        raise TimeoutError(f"Court book {court_book_id} was abandoned before its results were saved")
+
+    # Save output, keeping the raw extract so stage 4 can reuse it instead of downloading it again
+    df = save_to_store(rows, court_book_id)
+    if response_data:
+        with BookStore(OUTPUT_LOCATION, court_book_id) as store:
+            store.save_json("source_extract", response_data)
+            store.save_json("source_extract_meta", dict(validators, fetched_at=time.time()))
+    return df
+
+def fetch_book_items(client, court_book_id, timeout=10):
     """Fetch book item descriptions from the new endpoint."""
     url = f"/sparke/api/v0/books/{court_book_id}/chronology/bookitems/"
-    response_data = client.fetch_api_data(url)
+    response_data = client.fetch_api_data(url, timeout=timeout)
 
     # Create a lookup dictionary {id: description}
-    book_item_lookup = {str(item["id"]): item["description"] for item in response_data if "id" in item and "description" in item}
+    book_item_lookup = {str(item["id"]): item["description"] for item in response_data or [] if "id" in item and "description" in item}
     
     return book_item_lookup
 
-def main():
-    """Main function to process court books from the CSV file."""
-    client = APIClient(BASE_URL, LOGIN_PAGE_URL, LOGIN_URL)
-    if not client.authenticate():
-        print("Authentication failed. Exiting.")
-        log_progress("❌ ERROR: Authentication failed. Exiting.")
-        return
-
-    existing_files = {os.path.basename(f) for f in glob.glob(os.path.join(OUTPUT_LOCATION, "*_courtbook.csv"))}
-
-    with open(CSV_FILE, newline='') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header
-
-        for row in reader:
-            if not row or not row[0].strip():
-                continue
-
-            court_book_id = row[0].strip()
-            expected_filename = f"{court_book_id}_courtbook.csv"
-
-            if expected_filename in existing_files:
-                print(f"Skipping {court_book_id}; file exists.")
-                log_progress(f"ℹ️ Skipping {court_book_id}; file already exists.")
-            else:
+def has_courtbook(court_book_id):
+    """True if stage 1 output for the book is already in its store."""
+    with BookStore(OUTPUT_LOCATION, court_book_id) as store:
+        return store.has_table("courtbook")
+
+def main(client=None, court_book_ids=None):
+    """Main function to process court books from the CSV file.
+
+    client and court_book_ids can be supplied by the orchestrator to reuse an authenticated session
+    and an already-read book list. Returns {court_book_id: DataFrame} for the books extracted.
+    """
+    if client is None:
+        client = APIClient(BASE_URL, LOGIN_PAGE_URL, LOGIN_URL)
+        if not client.authenticate():
+            print("Authentication failed. Exiting.")
+            log_progress("❌ ERROR: Authentication failed. Exiting.")
+            return {}
+
+    if court_book_ids is None:
+        court_book_ids = read_court_book_ids()
+
+    existing_books = set(BookStore.list_books(OUTPUT_LOCATION))
+    to_extract = []
+
+    for court_book_id in court_book_ids:
+        if court_book_id in existing_books and has_courtbook(court_book_id):
+            print(f"Skipping {court_book_id}; already extracted.")
+            log_progress(f"ℹ️ Skipping {court_book_id}; already extracted.")
+        else:
+            to_extract.append(court_book_id)
+
+    return extract_books(client, to_extract)
+
+def extract_books(client, court_book_ids):
+    """Extracts several court books concurrently, giving each its own BOOK_TIME_BUDGET from when it starts.
+
+    Returns {court_book_id: DataFrame} for the books that finished in time.
+    """
+    extracted = {}
+    if not court_book_ids:
+        return extracted
+
+    started = {}  # court_book_id -> start time, set by the worker thread when the book begins
+    lock = threading.Lock()
+    saving = set()  # Books past the point of no return: their results are being saved
+    abandoned = set()  # Books reported as timed out: their results must not be saved
+
+    def claim_save(court_book_id):
+        with lock:
+            if court_book_id in abandoned:
+                return False
+            saving.add(court_book_id)
+            return True
+
+    def run(court_book_id):
+        started[court_book_id] = time.monotonic()
+        deadline = started[court_book_id] + BOOK_TIME_BUDGET
+        with METRICS.timer("book_stage_seconds", stage="01", book=court_book_id):
+            df = process_court_book(client, court_book_id, deadline, claim_save=lambda: claim_save(court_book_id))
+        METRICS.inc("entries_processed_total", len(df), stage="01", book=court_book_id)
+        return df
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_BOOK_WORKERS)
+    pending = {executor.submit(run, court_book_id): court_book_id for court_book_id in court_book_ids}
+
+    try:
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                court_book_id = pending.pop(future)
                 try:
-                    with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(process_court_book, client, court_book_id)
-                        future.result(timeout=30)
-                except concurrent.futures.TimeoutError:
-                    error_msg = f"❌ ERROR: Timed out processing court book ID {court_book_id} (over 30s)"
+                    extracted[court_book_id] = future.result()
+                except TimeoutError as e:
+                    METRICS.inc("book_errors_total", stage="01", book=court_book_id, reason="timeout")
+                    error_msg = f"❌ ERROR: Timed out processing court book ID {court_book_id}: {e}"
+                    print(error_msg)
+                    log_progress(error_msg)
+                except Exception as e:
+                    METRICS.inc("book_errors_total", stage="01", book=court_book_id, reason="error")
+                    error_msg = f"❌ ERROR: Failed to extract court book ID {court_book_id}: {e}"
+                    print(error_msg)
+                    log_progress(error_msg)
+
+            # Abandon books that have used up their own budget; queued books are not penalised.
+            # A book already saving its results is left to finish, anything later is discarded by its thread.
+            now = time.monotonic()
+            for future, court_book_id in list(pending.items()):
+                if court_book_id in started and now - started[court_book_id] > BOOK_TIME_BUDGET:
+                    with lock:
+                        if court_book_id in saving:
+                            continue
+                        abandoned.add(court_book_id)
+                    pending.pop(future)
+                    METRICS.inc("book_errors_total", stage="01", book=court_book_id, reason="timeout")
+                    error_msg = f"❌ ERROR: Timed out processing court book ID {court_book_id} (over {BOOK_TIME_BUDGET}s)"
                     print(error_msg)
                     log_progress(error_msg)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
+    return extracted
 
 
 if __name__ == "__main__":
@@ -2,15 +2,27 @@ import pandas as pd
 import datetime
 import logging
 import re
-from supporting_files.llm_class import LLMClient  # Custom LLM Client
+from supporting_files.llm_class import LLMClient, THROTTLE  # Custom LLM Client
+from supporting_files.cache_class import ResponseCache
+from supporting_files.store_class import BookStore, EntryState
+from supporting_files.metrics_class import METRICS
+from supporting_files.log_sink_class import LOG_SINK
 import os
-import glob
 import csv
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # CONSTANTS
 OUTPUT_LOCATION = 'outputs/'  # Folder to save the output files
 SUPPORT_LOCATION = 'supporting_files/'  # Folder containing support files
 RECORDS_TO_PROCESS = 50  # Number of records to process in each file
+BATCH_MODE = False  # True = submit the whole book through the async task API instead of per-row chat requests
+MAX_IN_FLIGHT_REQUESTS = 16  # Worker threads; the shared LLM throttle adapts actual concurrency below this (1 = one row at a time)
+CACHE_LOCATION = 'cache/llm_responses/'  # Kept outside outputs/ so it survives cleanup
+CACHE_MAX_BYTES = 500 * 1024 * 1024  # Evict least recently used responses above this size
+BYPASS_RESPONSE_CACHE = False  # Set True to always send requests to the LLM
+STATE_LOCATION = 'state/'  # Per-book entry hashes and responses, kept across runs (outside outputs/)
+RESULT_COLUMNS = ["UniqueID","LineID", "Source Doc", "PartNo", "EntryDate", "EntryDescription", "EntryOriginal", "Response", "Handwritten", "TimeProcessed"]
 
 # --- Custom CSV Log Handler ---
 class CSVLogHandler(logging.Handler):
@@ -23,13 +35,14 @@ class CSVLogHandler(logging.Handler):
                 writer.writerow(["timestamp", "level", "message"])
 
     def emit(self, record):
+        """Formats the record as a CSV row and hands it to the shared log sink, which batches the file writes."""
         try:
             timestamp = datetime.datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
             level = record.levelname
             message = self.format(record)
-            with open(self.filename, 'a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([timestamp, level, message])
+            row = io.StringIO()
+            csv.writer(row).writerow([timestamp, level, message])
+            LOG_SINK.write(self.filename, row.getvalue(), newline='')
         except Exception:
             self.handleError(record)
 
@@ -45,9 +58,16 @@ formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 csv_handler.setFormatter(formatter)
 logger.addHandler(csv_handler)
 
-# --- File Lookup ---
-courtbook_files = glob.glob(f"{OUTPUT_LOCATION}*courtbook.csv")
-chronology_files = set(glob.glob(f"{OUTPUT_LOCATION}*chronology.csv"))
+def set_output_location(location):
+    """Points the stage, and its CSV run log, at another outputs folder (used by queue workers)."""
+    global OUTPUT_LOCATION, csv_handler
+    OUTPUT_LOCATION = location
+    os.makedirs(location, exist_ok=True)
+    logger.removeHandler(csv_handler)
+    csv_handler = CSVLogHandler(os.path.join(location, "run_logs.csv"))
+    csv_handler.setLevel(logging.INFO)
+    csv_handler.setFormatter(formatter)
+    logger.addHandler(csv_handler)
 
 # --- LLM Processing Functions ---
 def extract_bullet_points(response):
@@ -63,94 +83,250 @@ def process_row(original, prompt):
     """Processes a single row by sending data to the LLM and retrieving the response."""
     try:
         response = llm_client.send_chat_request(original, prompt)
-        if response:
-            return extract_bullet_points(response)
-        return "Error: No response received"
+        if not response:
+            return "Error: No response received"
+        if response.startswith("Error"):
+            return response  # Kept as an error so the row is retried, as in process_batch_responses
+        return extract_bullet_points(response)
     except Exception as e:
         logging.error(f"Error processing row: {e}")
         return "Error: Exception occurred"
 
-def process_courtbook_file(input_file, prompt_file, output_prefix):
-    global llm_client  # Allow resetting the client
+def process_batch_responses(responses):
+    """Applies the same post-processing as process_row to responses returned by batch mode."""
+    processed = []
+    for response in responses:
+        if not response:
+            processed.append("Error: No response received")
+        elif response.startswith("Error"):
+            processed.append(response)
+        else:
+            processed.append(extract_bullet_points(response))
+    return processed
+
+def previous_response(row):
+    """Returns the response carried forward by stage 1 for an unchanged entry, or None."""
+    response = row.get("Previous Response")
+    return response if isinstance(response, str) and response else None
 
+def fetch_batch_responses(df, prompt_dict):
+    """Sends every row that needs the LLM through the async task API in one batch. Returns {row index: response}."""
+    llm_rows = [
+        (index, row["Entry_Original"], prompt_dict.get(row["PromptID"], "Default Prompt"))
+        for index, row in df.iterrows()
+        if str(row.get("Handwritten", "false")).strip().lower() != "true"
+        and prompt_dict.get(row["PromptID"], "Default Prompt") is not None
+        and previous_response(row) is None
+    ]
+    if not llm_rows:
+        return {}
+
+    logging.info(f"Batch mode: submitting {len(llm_rows)} entries as async tasks")
     try:
-        df = pd.read_csv(input_file)
+        responses = llm_client.run_batch([(original, prompt_text) for _, original, prompt_text in llm_rows])
+    except Exception as e:
+        logging.error(f"Error in batch mode: {e}")
+        responses = ["Error: Exception occurred"] * len(llm_rows)
+    return dict(zip([index for index, _, _ in llm_rows], process_batch_responses(responses)))
+
+def process_courtbook_row(row, prompt_dict, batch_responses=None):
+    """Builds the output record for a single court book row, calling the LLM where required.
+
+    In batch mode the response is looked up in batch_responses instead of sending a chat request.
+    """
+    entry_date = row["Entry Date"]
+    entry_description = row["Entry Description"]
+    original = row["Entry_Original"]
+    prompt_id = row["PromptID"]
+    unique_id = row.get("Unique ID", "-")
+    line_id = row.get("Line ID", "-")
+    part_no = row.get("Part", "-")
+    handwritten = str(row.get("Handwritten", "false")).strip().lower()  # Ensure lowercase string comparison
+    book_item_desc = row.get("Book Item Description", "-")
+    prompt_text = prompt_dict.get(prompt_id, "Default Prompt")
+
+    # Skip processing if handwritten is "true"
+    if handwritten == "true":
+        response = "** handwritten **"
+    elif prompt_text is None:
+        logging.error(f"No prompt found for PromptID: {prompt_id}")
+        response = "Error: No prompt found"
+    elif previous_response(row) is not None:
+        response = previous_response(row)  # Entry unchanged since the last run
+    elif batch_responses is not None:
+        response = batch_responses.get(row.name, "Error: No response received")
+    else:
+        response = process_row(original, prompt_text)
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [unique_id, line_id, book_item_desc, part_no, entry_date, entry_description, original, response, handwritten, timestamp]
+
+def is_complete(record, row):
+    """True if a journal record is a finished result for this court book row (errors are retried)."""
+    return (
+        record.get("UniqueID") == row.get("Unique ID")
+        and record.get("PartNo") == row.get("Part")
+        and isinstance(record.get("Response"), str)
+        and not record["Response"].startswith("Error")
+    )
+
+def process_courtbook(court_book_id, prompt_file, df=None):
+    """Generates responses for a court book, journaling each row's result to the book store as it arrives.
+
+    Rows already completed in the journal (from an interrupted run) are not sent again, so a restart
+    resumes at the first missing row. df can be passed in by the orchestrator to skip re-reading the
+    stage 1 table. Returns the results DataFrame, or None if the book could not be processed.
+    """
+    store = BookStore(OUTPUT_LOCATION, court_book_id)
+    journal = {}
+    try:
+        if df is None:
+            df = store.read_frame("courtbook")
+        if df is None:
+            logging.error(f"No extracted court book data found for {court_book_id}")
+            return None
         required_input_columns = {"Unique ID", "Line ID","Part", "Entry Date", "Entry Description", "Entry_Original", "PromptID", "Handwritten"}
         if not required_input_columns.issubset(df.columns):
             missing = required_input_columns - set(df.columns)
-            logging.error(f"Input file {input_file} missing required columns: {missing}")
-            return
+            logging.error(f"Court book {court_book_id} missing required columns: {missing}")
+            return None
 
         prompt_df = pd.read_csv(prompt_file)
         required_prompt_columns = {"prompt_id", "prompt_text"}
         if not required_prompt_columns.issubset(prompt_df.columns):
             missing = required_prompt_columns - set(prompt_df.columns)
             logging.error(f"Prompt file {prompt_file} missing required columns: {missing}")
-            return
+            return None
 
         prompt_dict = dict(zip(prompt_df["prompt_id"], prompt_df["prompt_text"]))
         total_records = len(df)
-        num_parts = (total_records + RECORDS_TO_PROCESS - 1) // RECORDS_TO_PROCESS  # Calculate total parts
-
-        for part in range(num_parts):
-            start_idx = part * RECORDS_TO_PROCESS
-            end_idx = min((part + 1) * RECORDS_TO_PROCESS, total_records)
-
-            logging.info(f"Processing records {start_idx + 1} to {end_idx} of {total_records} in {input_file}")
-
-            batch_df = df.iloc[start_idx:end_idx]  # Get the current batch
-            results = []
-
-            for index, row in batch_df.iterrows():
-                if index % 50 == 0:  # Restart API client every 50 requests
-                    logging.info("Restarting API client to prevent session issues.")
-                    llm_client = LLMClient()  # Reinitialize the client
-
-                entry_date = row["Entry Date"]
-                entry_description = row["Entry Description"]
-                original = row["Entry_Original"]
-                prompt_id = row["PromptID"]
-                unique_id = row.get("Unique ID", "-")
-                line_id = row.get("Line ID", "-")
-                part_no = row.get("Part", "-")
-                handwritten = str(row.get("Handwritten", "false")).strip().lower()  # Ensure lowercase string comparison
-                book_item_desc = row.get("Book Item Description", "-")
-                prompt_text = prompt_dict.get(prompt_id, "Default Prompt")
-
-                # Skip processing if handwritten is "true"
-                if handwritten == "true":
-                    response = "** handwritten **"
-                elif prompt_text is None:
-                    logging.error(f"No prompt found for PromptID: {prompt_id}")
-                    response = "Error: No prompt found"
-                else:
-                    response = process_row(original, prompt_text)
-
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                results.append([unique_id, line_id,book_item_desc, part_no, entry_date, entry_description, original, response, handwritten, timestamp])
-
-            # Save batch results to CSV
-            part_filename = output_prefix.replace("chronology.csv", f"part{part + 1}.csv")
-            output_df = pd.DataFrame(results, columns=["UniqueID","LineID", "Source Doc", "PartNo", "EntryDate", "EntryDescription", "EntryOriginal", "Response", "Handwritten", "TimeProcessed"])
-            output_df.to_csv(part_filename, index=False)
-
-            logging.info(f"Saved batch {part + 1} to {part_filename}")
+
+        # Resume from the journal: only rows without a finished result are processed
+        journal = store.journal_load()
+        pending_df = df[[not is_complete(journal.get(index, {}), row) for index, row in df.iterrows()]]
+        if len(pending_df) < total_records:
+            logging.info(f"Resuming court book {court_book_id}: {total_records - len(pending_df)} of {total_records} rows already done")
+
+        batch_responses = fetch_batch_responses(pending_df, prompt_dict) if BATCH_MODE else None
+        num_parts = (len(pending_df) + RECORDS_TO_PROCESS - 1) // RECORDS_TO_PROCESS  # Calculate total parts
+
+        with ThreadPoolExecutor(max_workers=max(1, MAX_IN_FLIGHT_REQUESTS)) as executor:
+            for part in range(num_parts):
+                batch_df = pending_df.iloc[part * RECORDS_TO_PROCESS:(part + 1) * RECORDS_TO_PROCESS]  # Get the current batch
+                logging.info(f"Processing batch {part + 1} of {num_parts} ({len(batch_df)} rows) in court book {court_book_id}")
+
+                futures = {
+                    executor.submit(process_courtbook_row, row, prompt_dict, batch_responses): index
+                    for index, row in batch_df.iterrows()
+                }
+                # Journal each result as soon as it arrives so a crash loses at most the rows in flight
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        record = dict(zip(RESULT_COLUMNS, future.result()))
+                    except Exception as e:
+                        logging.error(f"Error processing row {index} of court book {court_book_id}: {e}")
+                        continue
+                    store.journal_append(index, record)
+
+                logging.info(f"Journaled batch {part + 1} of {num_parts} for court book {court_book_id}")
+
+        # Rebuild the full, ordered results table from the journal, so resumed and fresh rows read back alike
+        journal = store.journal_load()
+        results_df = pd.DataFrame(
+            [journal[index] for index in df.index if index in journal],
+            index=[index for index in df.index if index in journal],
+            columns=RESULT_COLUMNS
+        )
+        store.write_frame("responses", results_df)
 
     except Exception as e:
-        logging.error(f"Unexpected error processing {input_file}: {e}")
+        logging.error(f"Unexpected error processing court book {court_book_id}: {e}")
+        return None
+    finally:
+        store.close()
+
+    if results_df.empty:
+        return None
+    update_entry_state(court_book_id, df, results_df)
+    return results_df.reset_index(drop=True)
+
+def update_entry_state(court_book_id, courtbook_df, results_df):
+    """Records each fully successful entry's content hash and part responses so unchanged entries are skipped next run."""
+    if "Content Hash" not in courtbook_df.columns:
+        return
+    processed = courtbook_df.loc[results_df.index]  # results_df is indexed by court book row
+    entries = {}
+    failed = set()
+    for line_id, content_hash, handwritten, response in zip(
+        processed["Line ID"], processed["Content Hash"], results_df["Handwritten"], results_df["Response"]
+    ):
+        line_id = str(line_id)
+        if handwritten == "true":
+            continue
+        if not isinstance(response, str) or response.startswith("Error"):
+            failed.add(line_id)
+            continue
+        entries.setdefault(line_id, (content_hash, []))[1].append(response)
+
+    entries = {line_id: value for line_id, value in entries.items() if line_id not in failed}
+    EntryState(STATE_LOCATION, court_book_id).update(entries)
+    logging.info(f"Saved state for {len(entries)} entries of court book {court_book_id}")
 
 # --- Main Processing ---
-llm_client = LLMClient()
+response_cache = None if BYPASS_RESPONSE_CACHE else ResponseCache(CACHE_LOCATION, max_bytes=CACHE_MAX_BYTES)
+llm_client = LLMClient(cache=response_cache)
+
+def main(llm=None, courtbooks=None, court_book_ids=None):
+    """Generates chronologies for every extracted court book that has no chronology yet.
+
+    llm and courtbooks ({court_book_id: DataFrame} from stage 1) can be supplied by the orchestrator
+    to share one LLMClient and skip re-reading the court book tables; court_book_ids limits the run to
+    those books. Returns {court_book_id: results DataFrame}.
+    """
+    global llm_client
+    if llm is not None:
+        llm_client = llm
+    courtbooks = courtbooks or {}
 
-def main():
     PROMPT_FILE = f"{SUPPORT_LOCATION}prompt_list.csv"
-    for cb_file in courtbook_files:
-        expected_chronology = cb_file.replace("courtbook.csv", "chronology.csv")
-        if expected_chronology not in chronology_files:
-            logging.info(f"Processing file: {cb_file} (missing corresponding chronology file)")
-            process_courtbook_file(cb_file, PROMPT_FILE, expected_chronology)
+    generated = {}
+
+    book_ids = BookStore.list_books(OUTPUT_LOCATION)
+    if court_book_ids is not None:
+        wanted = set(map(str, court_book_ids))
+        book_ids = [court_book_id for court_book_id in book_ids if court_book_id in wanted]
+
+    for court_book_id in book_ids:
+        with BookStore(OUTPUT_LOCATION, court_book_id) as store:
+            has_courtbook = store.has_table("courtbook")
+            has_chronology = store.has_table("chronology")
+        if not has_courtbook:
+            continue
+        if not has_chronology:
+            logging.info(f"Processing court book {court_book_id} (no chronology generated yet)")
+            with METRICS.timer("book_stage_seconds", stage="02", book=court_book_id):
+                results = process_courtbook(court_book_id, PROMPT_FILE, df=courtbooks.get(court_book_id))
+            if results is not None:
+                generated[court_book_id] = results
+                errors = int(results["Response"].astype(str).str.startswith("Error").sum())
+                METRICS.inc("entries_processed_total", len(results), stage="02", book=court_book_id)
+                METRICS.inc("entry_errors_total", errors, stage="02", book=court_book_id)
+            else:
+                METRICS.inc("book_errors_total", stage="02", book=court_book_id, reason="error")
         else:
-            logging.info(f"Skipping {cb_file}; corresponding chronology file exists: {expected_chronology}")
+            logging.info(f"Skipping court book {court_book_id}; chronology already generated")
+
+    # Run summary
+    logging.info(THROTTLE.summary())
+    logging.info(llm_client.metrics_summary())
+    if response_cache is not None:
+        logging.info(response_cache.summary())
+        response_cache.save_index()  # Lets the next run start from this size instead of walking the cache
+    else:
+        logging.info("LLM cache bypassed for this run.")
+
+    return generated
 
 if __name__ == "__main__":
     main()
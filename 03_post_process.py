@@ -1,17 +1,22 @@
 import pandas as pd
-import glob
 import os
 import logging
 import re
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment
-from openpyxl.worksheet.table import Table, TableStyleInfo
+import warnings
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.filters import AutoFilter
+from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
 from openpyxl.formatting.rule import CellIsRule, FormulaRule
 from openpyxl.styles import PatternFill
+from supporting_files.store_class import BookStore
+from supporting_files.metrics_class import METRICS
 
 # Constants
-OUTPUT_LOCATION = "outputs/"  # Folder containing part files
-FILE_PATTERN = "*_part*.csv"  # Pattern to match all part files
+OUTPUT_LOCATION = "outputs/"  # Folder containing the book stores and final exports
+FIXED_WIDTHS = {"C": 30, "D": 100}  # EntryOriginal and Response (fits description + response content)
 
 # Logging Configuration
 logging.basicConfig(
@@ -19,147 +24,168 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+BULLET_PATTERN = re.compile(r"\n\s*[*\-•→]+")  # Extra spaces before bullet points
+UNWANTED_PREFIXES = ("BrewChat", "Dates are answered in the format")
+
 def clean_response(text):
     """Cleans the 'Response' text by removing unnecessary bullet points and formatting."""
     if not isinstance(text, str):
         return text  # Return as-is if not a string
-    
+
     # Remove extra spaces between bullet points
-    text = re.sub(r"\n\s*[*\-•→]+", "\n*", text)
-    
-    # Remove unwanted bullet points
-    lines = text.split("\n")
-    cleaned_lines = [
-        line.strip() for line in lines  # Remove leading/trailing whitespace
-        if line.strip() and  # Skip empty lines
-        not line.startswith("BrewChat") and
-        "XML" not in line and
-        not line.startswith("Dates are answered in the format")
-    ]
-    
-    # Replace "â€¢" with "*"
-    cleaned_text = "\n".join(["\t" + line for line in cleaned_lines]).replace("â€¢", "*")  # Add tab indentation to each line
-    
-    return cleaned_text.strip()  # Ensure no leading/trailing whitespace
+    lines = BULLET_PATTERN.sub("\n*", text).split("\n")
 
-from openpyxl.formatting.rule import CellIsRule, FormulaRule
-from openpyxl.styles import PatternFill
+    # Remove unwanted lines, strip the rest and add tab indentation to each line after the first
+    cleaned_text = "\n\t".join(
+        stripped for line, stripped in zip(lines, map(str.strip, lines))
+        if stripped and "XML" not in line and not line.startswith(UNWANTED_PREFIXES)
+    )
 
-def format_excel(file_path):
-    """Applies formatting to the final Excel file, including conditional formatting for the 'Response' column."""
-    wb = load_workbook(file_path)
-    ws = wb.active
-
-    # Freeze the top row
-    ws.freeze_panes = "A2"
-
-    # Auto adjust column widths for all except fixed-width columns
-    for col in ws.columns:
-        max_length = 0
-        col_letter = col[0].column_letter
-        if col_letter not in ["C", "D"]:  # Skipping "EntryOriginal" and "Response"
-            for cell in col:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            ws.column_dimensions[col_letter].width = max_length + 2
-
-    # Set fixed widths for specific columns
-    ws.column_dimensions["C"].width = 30  # EntryOriginal column
-    ws.column_dimensions["D"].width = 100  # Response column (adjusted to fit description + response content)
-
-    # Wrap text in Response column
-    for cell in ws["D"]:
-        cell.alignment = Alignment(wrap_text=True)
+    # Replace "â€¢" with "*"
+    return cleaned_text.replace("â€¢", "*").strip()  # Ensure no leading/trailing whitespace
+
+def clean_responses(responses):
+    """Cleans a whole 'Response' column in one pass, without building a row Series per value."""
+    return pd.Series([clean_response(text) for text in responses], index=responses.index, dtype=object)
+
+def combine_parts(df):
+    """Recombines the parts of each entry: first value of each column, responses joined one per line."""
+    grouped = df.groupby("UniqueID", as_index=False)
+    combined = grouped.agg({
+        "EntryDate": "first",
+        "Source Doc": "first",
+        "EntryOriginal": "first",
+        "Handwritten": "first",
+        "TimeProcessed": "first"
+    })
+    joined = df["Response"].dropna().str.strip().groupby(df["UniqueID"]).agg("\n".join)
+    combined["Response"] = "\n" + joined.reindex(combined["UniqueID"]).fillna("").str.lstrip("\n").to_numpy()
+    return combined[["UniqueID", "EntryDate", "Source Doc", "EntryOriginal", "Response", "Handwritten", "TimeProcessed"]]
+
+def column_width(series, header):
+    """Width for a column from its longest value (as written) or header, plus padding."""
+    values = series[series.notna() & (series != "")].astype(str)
+    longest = values.str.len().max() if len(values) else 0
+    return max(len(str(header)), int(longest)) + 2
+
+def write_excel(df, file_path):
+    """Writes the final Excel file in one streaming pass, with its table, frozen header and conditional formatting for the 'Response' column."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    last_column = get_column_letter(len(df.columns))
+    last_row = len(df) + 1
+
+    # Sheet settings must be in place before any rows are streamed
+    ws.freeze_panes = "A2"  # Freeze the top row
+    ws.sheet_view.showGridLines = False  # Hide gridlines
+
+    # Column widths from the data, except fixed-width columns
+    for position, column in enumerate(df.columns, start=1):
+        col_letter = get_column_letter(position)
+        ws.column_dimensions[col_letter].width = FIXED_WIDTHS.get(col_letter) or column_width(df[column], column)
 
     # Conditional Formatting for "Response" column
-    response_col = "D2:D" + str(ws.max_row)  # Target all cells in column E, starting from row 2
-
-    # Define color fills
+    response_col = f"D2:D{max(last_row, 2)}"  # Range must cover at least one row even for an empty book
     red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")  # Light Red
     yellow_fill = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")  # Light Yellow
-    #green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Light Green
-
-    # Apply conditional formatting based on words
-    ws.conditional_formatting.add(response_col, 
-        FormulaRule(formula=[f'ISNUMBER(SEARCH("inconclusive", D2))'], stopIfTrue=True, fill=red_fill))
-    ws.conditional_formatting.add(response_col, 
-        FormulaRule(formula=[f'ISNUMBER(SEARCH("handwritten", D2))'], stopIfTrue=True, fill=yellow_fill))
-    #ws.conditional_formatting.add(response_col, 
-        #FormulaRule(formula=[f'ISNUMBER(SEARCH("success", E2))'], stopIfTrue=True, fill=green_fill))
+    ws.conditional_formatting.add(response_col,
+        FormulaRule(formula=['ISNUMBER(SEARCH("inconclusive", D2))'], stopIfTrue=True, fill=red_fill))
+    ws.conditional_formatting.add(response_col,
+        FormulaRule(formula=['ISNUMBER(SEARCH("handwritten", D2))'], stopIfTrue=True, fill=yellow_fill))
 
     # Format as table
-    table = Table(displayName="CourtBookData", ref=ws.dimensions)
-    style = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
-                           showLastColumn=False, showRowStripes=True, showColumnStripes=False)
-    table.tableStyleInfo = style
-    ws.add_table(table)
-
-    # Hide gridlines
-    ws.sheet_view.showGridLines = False
+    table_ref = f"A1:{last_column}{last_row}"
+    table = Table(displayName="CourtBookData", ref=table_ref, autoFilter=AutoFilter(ref=table_ref))
+    # Write-only sheets can't read the headings back, so the table columns are declared up front
+    table.tableColumns = [TableColumn(id=position, name=str(column)) for position, column in enumerate(df.columns, start=1)]
+    table.tableStyleInfo = TableStyleInfo(name="TableStyleMedium9", showFirstColumn=False,
+                                          showLastColumn=False, showRowStripes=True, showColumnStripes=False)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # openpyxl reminds write-only users to add columns, done above
+        ws.add_table(table)
+
+    # Stream the rows; only Response cells need a styled cell (wrapped text)
+    wrap = Alignment(wrap_text=True)
+    header_font = Font(bold=True)
+    response_position = 3  # Column D
+    header = []
+    for position, column in enumerate(df.columns):
+        cell = WriteOnlyCell(ws, value=str(column))
+        cell.font = header_font
+        if position == response_position:
+            cell.alignment = wrap
+        header.append(cell)
+    ws.append(header)
+
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        row = list(row)
+        if len(row) > response_position:
+            cell = WriteOnlyCell(ws, value=row[response_position])
+            cell.alignment = wrap
+            row[response_position] = cell
+        ws.append(row)
 
     wb.save(file_path)
 
 
-def concatenate_parts():
-    """Concatenates all part CSV files into a single final Excel file per court book and recombines entries with the same Unique ID."""
-    part_files = glob.glob(os.path.join(OUTPUT_LOCATION, FILE_PATTERN))
-    
-    if not part_files:
-        logging.info("No part files found for concatenation.")
-        return
-    
-    # Group part files by court book ID (extract ID before '_part')
-    courtbook_groups = {}
-    for file in part_files:
-        base_name = os.path.basename(file)
-        courtbook_id = base_name.split("_part")[0]  # Extract courtbook ID
-        courtbook_groups.setdefault(courtbook_id, []).append(file)
-    
+def concatenate_parts(parts=None, court_book_ids=None):
+    """Combines the generated responses into a single final Excel file per court book and recombines entries with the same Unique ID.
+
+    parts ({court_book_id: DataFrame} from stage 2) can be supplied by the orchestrator to use the
+    generated results directly instead of re-reading them from the store; court_book_ids limits the run
+    to those books. Returns {court_book_id: final DataFrame}.
+    """
+    parts = parts or {}
+    courtbook_ids = sorted(set(BookStore.list_books(OUTPUT_LOCATION)) | set(parts))
+    if court_book_ids is not None:
+        wanted = set(map(str, court_book_ids))
+        courtbook_ids = [courtbook_id for courtbook_id in courtbook_ids if courtbook_id in wanted]
+    final_frames = {}
+    if not courtbook_ids:
+        logging.info("No generated responses found for concatenation.")
+        return final_frames
+
     # Process each court book
-    for courtbook_id, files in courtbook_groups.items():
-        files.sort()  # Ensure proper order (part1, part2, etc.)
-        logging.info(f"Merging {len(files)} parts for court book {courtbook_id}")
+    for courtbook_id in courtbook_ids:
+        with BookStore(OUTPUT_LOCATION, courtbook_id) as store, METRICS.timer("book_stage_seconds", stage="03", book=courtbook_id):
+            if courtbook_id in parts:
+                logging.info(f"Merging generated results for court book {courtbook_id}")
+                final_df = parts[courtbook_id].copy()
+            else:
+                final_df = store.read_frame("responses")
+                if final_df is None:
+                    continue
+                logging.info(f"Merging {len(final_df)} generated rows for court book {courtbook_id}")
         
-        # Concatenate CSV files
-        df_list = [pd.read_csv(f) for f in files]
-        final_df = pd.concat(df_list, ignore_index=True)
+            # Clean 'Response' column
+            if "Response" in final_df.columns:
+                final_df["Response"] = final_df["EntryDescription"].map(str) + "\n" + clean_responses(final_df["Response"]).map(str)
         
-        # Clean 'Response' column
-        if "Response" in final_df.columns:
-            final_df["Response"] = final_df.apply(lambda row: f"{row['EntryDescription']}\n{clean_response(row['Response'])}", axis=1)
+            # Remove 'Part', 'EntryDescription', and 'UniqueID' columns
+            final_df.drop(columns=["Part", "EntryDescription", "UniqueID"], inplace=True, errors='ignore')
         
-        # Remove 'Part', 'EntryDescription', and 'UniqueID' columns
-        final_df.drop(columns=["Part", "EntryDescription", "UniqueID"], inplace=True, errors='ignore')
+            # Recombine entries with the same Unique ID
+            if "UniqueID" in final_df.columns:
+                final_df = combine_parts(final_df)
         
-        # Recombine entries with the same Unique ID
-        if "UniqueID" in final_df.columns:
-            final_df = final_df.groupby("UniqueID", as_index=False).agg({
-                "EntryDate": "first",
-                "Source Doc": "first",
-                "EntryOriginal": "first",
-                "Response": lambda x: "\n" + "\n".join(x.dropna().str.strip()).lstrip("\n") if not x.empty else "",
-                "Handwritten": "first",
-                "TimeProcessed": "first"
-            })
-        
-        # Drop 'UniqueID' before saving
-        final_df.drop(columns=["UniqueID"], inplace=True, errors='ignore')
+            # Drop 'UniqueID' before saving
+            final_df.drop(columns=["UniqueID"], inplace=True, errors='ignore')
 
-        # Define final column order (without UniqueID)
-        final_df = final_df[["Source Doc", "EntryDate", "EntryOriginal", "Response", "Handwritten", "TimeProcessed","LineID"]]
-        
-        # Save as Excel for better formatting
-        final_filename = os.path.join(OUTPUT_LOCATION, f"{courtbook_id}_chronology.xlsx")
-        final_df.to_excel(final_filename, index=False, engine="openpyxl")
+            # Define final column order (without UniqueID)
+            final_df = final_df[["Source Doc", "EntryDate", "EntryOriginal", "Response", "Handwritten", "TimeProcessed","LineID"]]
         
-        # Apply Excel formatting
-        format_excel(final_filename)
+            # Store for stage 4, then export as Excel for better formatting
+            store.write_frame("chronology", final_df)
+            final_filename = os.path.join(OUTPUT_LOCATION, f"{courtbook_id}_chronology.xlsx")
+            write_excel(final_df, final_filename)
         
-        # Log summary
-        logging.info(f"Final file saved: {final_filename} ({len(final_df)} unique entries processed)")
+            # Log summary
+            logging.info(f"Final file saved: {final_filename} ({len(final_df)} unique entries processed)")
+            METRICS.inc("entries_processed_total", len(final_df), stage="03", book=courtbook_id)
+            final_frames[courtbook_id] = final_df
+
+    return final_frames
  
 if __name__ == "__main__":
     concatenate_parts()
\ No newline at end of file
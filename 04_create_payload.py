@@ -1,41 +1,56 @@
 import os
 import json
-import csv
-import pandas as pd
 from supporting_files.webapp_class import APIClient
+from supporting_files.store_class import BookStore
+from supporting_files.metrics_class import METRICS
+from supporting_files.court_book_csv import read_court_book_ids
 from bs4 import BeautifulSoup
 from datetime import datetime
 import re
+import time
 
 # Constants
 BASE_URL = "http://sydwebdev139:8080"
 LOGIN_PAGE_URL = f"{BASE_URL}/sparke/authed/user.action?cmd=welcome"
 LOGIN_URL = f"{BASE_URL}/sparke/authed/j_security_check"
-CSV_FILE = "00_courtbooks_to_get.csv"
 OUTPUT_LOCATION = "outputs/"
+SOURCE_MAX_AGE = 900  # Seconds a stage 1 extract without ETag/Last-Modified is reused before refetching
+DELTA_MODE = True  # Payload holds only entries whose entryFinal differs from the webapp's; False sends every entry
 
 def save_json(data, filename):
-    """Saves JSON data to a file."""
+    """Saves JSON data to a file (final export, so written compactly)."""
     with open(os.path.join(OUTPUT_LOCATION, filename), "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
+        json.dump(data, file, ensure_ascii=False)
     print(f"JSON file saved: {filename}")
 
-def load_json(filename):
-    """Loads JSON data from a file."""
-    try:
-        with open(os.path.join(OUTPUT_LOCATION, filename), "r", encoding="utf-8") as file:
-            return json.load(file)
-    except Exception as e:
-        print(f"Error loading {filename}: {e}")
-        return []
-
-def fetch_court_book_data(client, court_book_id):
-    """Fetches court book chronology data from the API."""
-    response = client.fetch_api_data(f"/sparke/api/v0/books/{court_book_id}/chronology/")
-    if response:
-        save_json(response, f"{court_book_id}_source_extract.json")
-    else:
+def fetch_court_book_data(client, court_book_id, store):
+    """Makes sure the book store holds a current chronology extract, reusing the stage 1 download when it is still fresh.
+
+    With ETag/Last-Modified from stage 1 a conditional request is made and a 304 reuses the stored
+    extract. Without validators the stored extract is reused if it is younger than SOURCE_MAX_AGE.
+    """
+    endpoint = f"/sparke/api/v0/books/{court_book_id}/chronology/"
+    meta = store.load_json("source_extract_meta") or {}
+    has_extract = store.load_json("source_extract") is not None
+
+    if has_extract and not (meta.get("etag") or meta.get("last_modified")):
+        age = time.time() - meta.get("fetched_at", 0)
+        if age < SOURCE_MAX_AGE:
+            print(f"Reusing stage 1 extract for Court Book ID {court_book_id} ({age:.0f}s old)")
+            return
+
+    response, validators, changed = client.fetch_api_data_with_validators(endpoint, validators=meta if has_extract else None)
+    if response is None and has_extract and not changed:
+        print(f"Court Book ID {court_book_id} unchanged since stage 1; reusing stored extract")
+    elif response:
+        if has_extract and not changed:
+            print(f"Court Book ID {court_book_id} content unchanged since stage 1")
+        store.save_json("source_extract", response)
+        store.save_json("source_extract_meta", dict(validators, fetched_at=time.time()))
+    elif not has_extract:
         print(f"No data found for Court Book ID: {court_book_id}")
+    else:
+        print(f"Could not refresh Court Book ID {court_book_id}; using stage 1 extract")
 
 def format_response(response, source_doc):
     """Formats the response into structured semantic HTML."""
@@ -80,53 +95,101 @@ def format_response(response, source_doc):
 
     return "".join(html_parts)
 
-def merge_json_data(source_data, response_data):
-    """Merges source data with response data."""
+def normalise_html(html):
+    """Collapses whitespace so formatting-only differences don't count as changes."""
+    if not isinstance(html, str):
+        return ""
+    return re.sub(r"\s+", " ", re.sub(r">\s+<", "><", html)).strip()
+
+def merge_json_data(source_data, response_data, delta=False):
+    """Merges source data with response data.
+
+    Each entry is compared with the entryFinal the webapp currently holds and counted as unchanged,
+    updated or new (previously blank). With delta=True only updated and new entries are returned.
+    Returns (entries, summary counts).
+    """
     response_dict = {item["LineID"]: item["Response"] for item in response_data}
+    summary = {"unchanged": 0, "updated": 0, "new": 0}
+    merged = []
     for entry in source_data:
         entry_id = str(entry["id"])
-        if entry_id in response_dict:
-            entry["entryFinal"] = response_dict[entry_id]
-    return source_data
-
-def process_court_book(client, court_book_id):
-    """Handles full processing for a court book ID."""
-    fetch_court_book_data(client, court_book_id)
-    input_xlsx = f"outputs/{court_book_id}_chronology.xlsx"
-    output_json = f"{court_book_id}_response_extract.json"
-    
-    try:
-        df = pd.read_excel(input_xlsx, dtype=str)
-        required_columns = {"Response", "LineID", "Source Doc"}
-        if not required_columns.issubset(df.columns):
-            print(f"Missing required columns in {input_xlsx}")
-            return
-        df["Response"] = df.apply(lambda row: format_response(row["Response"], row["Source Doc"]), axis=1)
-        extracted_df = df[["LineID", "Response"]]
-        save_json(extracted_df.to_dict(orient="records"), output_json)
-    except Exception as e:
-        print(f"Error processing {input_xlsx}: {e}")
-    
-    source_data = load_json(f"{court_book_id}_source_extract.json")
-    response_data = load_json(f"{court_book_id}_response_extract.json")
-    merged_data = merge_json_data(source_data, response_data)
-    save_json(merged_data, f"{court_book_id}_payload.json")
-
-def main():
-    """Main function to handle all court books from the CSV file."""
-    client = APIClient(BASE_URL, LOGIN_PAGE_URL, LOGIN_URL)
-    if not client.authenticate():
-        print("Authentication failed. Exiting.")
-        return
-
-    with open(CSV_FILE, newline="") as file:
-        reader = csv.reader(file)
-        next(reader)  # skip header
-        for row in reader:
-            if not row or not row[0].strip():
+        if entry_id not in response_dict:
+            if not delta:
+                merged.append(entry)
+            continue
+        current = normalise_html(entry.get("entryFinal"))
+        if normalise_html(response_dict[entry_id]) == current:
+            summary["unchanged"] += 1
+            if delta:
                 continue
-            court_book_id = row[0].strip()
-            process_court_book(client, court_book_id)
+        else:
+            summary["updated" if current else "new"] += 1
+        entry["entryFinal"] = response_dict[entry_id]
+        merged.append(entry)
+    return merged, summary
+
+def process_court_book(client, court_book_id, chronology_df=None):
+    """Handles full processing for a court book ID.
+
+    chronology_df (from stage 3) can be supplied by the orchestrator to skip re-reading the store.
+    Returns the payload entries, or None if there was no usable chronology (no payload is written).
+    """
+    with BookStore(OUTPUT_LOCATION, court_book_id) as store:
+        fetch_court_book_data(client, court_book_id, store)
+
+        try:
+            df = chronology_df if chronology_df is not None else store.read_frame("chronology")
+            if df is None:
+                print(f"No chronology found for court book {court_book_id}")
+                return None
+            df = df.astype(str).where(df.notna())  # Text values, with blanks left as NaN
+            required_columns = {"Response", "LineID", "Source Doc"}
+            if not required_columns.issubset(df.columns):
+                print(f"Missing required columns in chronology for court book {court_book_id}")
+                return None
+            df["Response"] = df.apply(lambda row: format_response(row["Response"], row["Source Doc"]), axis=1)
+            extracted_df = df[["LineID", "Response"]]
+            store.write_frame("response_extract", extracted_df)
+            response_data = extracted_df.to_dict(orient="records")
+        except Exception as e:
+            print(f"Error processing chronology for court book {court_book_id}: {e}")
+            return None
+
+        source_data = store.load_json("source_extract") or []
+
+    merged_data, summary = merge_json_data(source_data, response_data, delta=DELTA_MODE)
+    save_json(merged_data, f"{court_book_id}_payload.json")
+    print(f"Court book {court_book_id} payload ({'delta' if DELTA_MODE else 'full'}): {len(merged_data)} entries - "
+          f"{summary['new']} new, {summary['updated']} updated, {summary['unchanged']} unchanged")
+    METRICS.inc("entries_processed_total", len(response_data), stage="04", book=court_book_id)
+    for change, count in summary.items():
+        METRICS.inc("payload_entries_total", count, change=change, book=court_book_id)
+    return merged_data
+
+def main(client=None, court_book_ids=None, chronologies=None):
+    """Main function to handle all court books from the CSV file.
+
+    client, court_book_ids and chronologies ({court_book_id: DataFrame} from stage 3) can be supplied
+    by the orchestrator to reuse its authenticated session and in-memory results.
+    Returns {court_book_id: payload entries} for the books a payload was written for.
+    """
+    if client is None:
+        client = APIClient(BASE_URL, LOGIN_PAGE_URL, LOGIN_URL)
+        if not client.authenticate():
+            print("Authentication failed. Exiting.")
+            return {}
+
+    if court_book_ids is None:
+        court_book_ids = read_court_book_ids()
+    chronologies = chronologies or {}
+
+    payloads = {}
+    for court_book_id in court_book_ids:
+        with METRICS.timer("book_stage_seconds", stage="04", book=court_book_id):
+            payload = process_court_book(client, court_book_id, chronologies.get(court_book_id))
+        if payload is not None:
+            payloads[court_book_id] = payload
+    return payloads
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,182 @@
+import os
+import csv
+import json
+import random
+import hashlib
+import time
+import concurrent.futures
+from datetime import datetime
+import requests
+from supporting_files.webapp_class import APIClient
+from supporting_files.metrics_class import METRICS
+from supporting_files.log_sink_class import LOG_SINK
+from supporting_files.court_book_csv import read_court_book_ids
+
+# Constants
+BASE_URL = "http://sydwebdev139:8080"
+LOGIN_PAGE_URL = f"{BASE_URL}/sparke/authed/user.action?cmd=welcome"
+LOGIN_URL = f"{BASE_URL}/sparke/authed/j_security_check"
+OUTPUT_LOCATION = "outputs/"
+PROGRESS_LOG = r"\\V0050\05_CTP_chronology\run_scripts\progress.log"
+WRITEBACK_ENDPOINT = "/sparke/api/v0/books/{court_book_id}/chronology/"
+MAX_BATCH_ENTRIES = 50  # Entries per PUT
+MAX_BATCH_BYTES = 1024 * 1024  # Encoded JSON size per PUT; large entries get smaller batches
+MAX_WRITEBACK_WORKERS = 4  # Concurrent PUTs over the shared session
+WRITEBACK_TIMEOUT = 60  # Seconds per PUT
+MAX_RETRIES = 3  # Retries for timeouts, connection errors, 429 and 5xx
+RETRY_BACKOFF = 2  # Seconds before the first retry, doubled each time (plus jitter) unless Retry-After is given
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+SPLITTABLE_STATUSES = {408, 413}  # Batch too big or too slow: retry it as two halves
+
+def log_progress(message):
+    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+    LOG_SINK.write(PROGRESS_LOG, f"{timestamp} {message}\n")
+
+def load_payload(court_book_id):
+    """Loads the stage 4 payload for a court book, or None if it doesn't exist."""
+    path = os.path.join(OUTPUT_LOCATION, f"{court_book_id}_payload.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def make_batches(entries, max_entries=MAX_BATCH_ENTRIES, max_bytes=MAX_BATCH_BYTES):
+    """Splits entries, in order, into batches under both the entry count and encoded size limits."""
+    batches = []
+    current, current_bytes = [], 2  # "[]"
+    for entry in entries:
+        entry_bytes = len(json.dumps(entry, ensure_ascii=False).encode("utf-8")) + 1  # Plus separator
+        if current and (len(current) >= max_entries or current_bytes + entry_bytes > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 2
+        current.append(entry)
+        current_bytes += entry_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+def idempotency_key(court_book_id, batch):
+    """Stable key for a batch's content, so a retried PUT can be recognised as the same write."""
+    digest = hashlib.sha256(json.dumps(batch, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return f"{court_book_id}-{digest.hexdigest()[:32]}"
+
+def put_batch(client, court_book_id, batch):
+    """PUTs one batch, retrying transient failures. Returns (status_code or None, error message or None, attempts)."""
+    endpoint = WRITEBACK_ENDPOINT.format(court_book_id=court_book_id)
+    headers = {"Idempotency-Key": idempotency_key(court_book_id, batch)}
+    attempt = 0
+    while True:
+        attempt += 1
+        retry_after = None
+        try:
+            response = client.put_json(endpoint, batch, timeout=WRITEBACK_TIMEOUT, headers=headers)
+            status, error = response.status_code, None
+            if 200 <= status < 300:
+                return status, None, attempt
+            error = f"{status} - {response.text[:200]}"
+            retry_after = response.headers.get("Retry-After")
+        except requests.exceptions.Timeout as e:
+            status, error = 408, f"Timed out: {e}"
+        except requests.exceptions.RequestException as e:
+            status, error = None, f"Request error: {e}"
+
+        retryable = status is None or status in RETRYABLE_STATUSES
+        if status in SPLITTABLE_STATUSES and len(batch) > 1:
+            retryable = False  # Resending the same oversized batch won't help; write_batch splits it instead
+        if not retryable or attempt > MAX_RETRIES:
+            return status, error, attempt
+
+        METRICS.inc("writeback_retries_total", status=status or "error")
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = RETRY_BACKOFF * (2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+        time.sleep(delay)
+
+def write_batch(client, court_book_id, batch):
+    """Writes a batch, splitting it in half when it is rejected as too large or too slow.
+
+    Returns one result dict per entry.
+    """
+    status, error, attempts = put_batch(client, court_book_id, batch)
+    if error and len(batch) > 1 and status in SPLITTABLE_STATUSES:
+        middle = len(batch) // 2
+        return write_batch(client, court_book_id, batch[:middle]) + write_batch(client, court_book_id, batch[middle:])
+    return [
+        {"id": entry.get("id"), "success": error is None, "status": status, "attempts": attempts, "error": error}
+        for entry in batch
+    ]
+
+def save_report(court_book_id, results):
+    """Saves the per-entry writeback results next to the payload."""
+    path = os.path.join(OUTPUT_LOCATION, f"{court_book_id}_writeback_report.csv")
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=["id", "success", "status", "attempts", "error"])
+        writer.writeheader()
+        writer.writerows(results)
+    return path
+
+def writeback_court_book(client, court_book_id):
+    """Sends a court book's payload back to the webapp in concurrent batches. Returns the per-entry results."""
+    entries = load_payload(court_book_id)
+    if entries is None:
+        print(f"No payload found for court book {court_book_id}; skipping writeback")
+        return []
+    if not entries:
+        print(f"Payload for court book {court_book_id} is empty; nothing to write back")
+        return []
+
+    batches = make_batches(entries)
+    print(f"Writing back {len(entries)} entries for court book {court_book_id} in {len(batches)} batches")
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WRITEBACK_WORKERS) as executor:
+        for batch_results in executor.map(lambda batch: write_batch(client, court_book_id, batch), batches):
+            results.extend(batch_results)
+
+    succeeded = sum(1 for result in results if result["success"])
+    failed = len(results) - succeeded
+    report_path = save_report(court_book_id, results)
+    METRICS.inc("entries_processed_total", succeeded, stage="05", book=court_book_id)
+    METRICS.inc("entry_errors_total", failed, stage="05", book=court_book_id)
+
+    message = f"Writeback for court book {court_book_id}: {succeeded} entries written, {failed} failed (report: {report_path})"
+    print(message)
+    log_progress(("⚠️ " if failed else "") + message)
+    if failed:
+        # Raised so the run stops before cleanup and the payload is kept for a rerun
+        raise RuntimeError(f"{failed} of {len(results)} entries for court book {court_book_id} were not written back")
+    return results
+
+def main(client=None, court_book_ids=None):
+    """Writes every court book's payload back to the webapp.
+
+    client and court_book_ids can be supplied by the orchestrator to reuse its authenticated session.
+    Returns {court_book_id: [per-entry results]}. Every book is attempted; if any had entries that
+    could not be written, a RuntimeError naming them is raised at the end.
+    """
+    if client is None:
+        client = APIClient(BASE_URL, LOGIN_PAGE_URL, LOGIN_URL)
+        if not client.authenticate():
+            print("Authentication failed. Exiting.")
+            log_progress("❌ ERROR: Authentication failed. Exiting.")
+            return {}
+
+    if court_book_ids is None:
+        court_book_ids = read_court_book_ids()
+
+    written = {}
+    failed_books = []
+    for court_book_id in court_book_ids:
+        try:
+            with METRICS.timer("book_stage_seconds", stage="05", book=court_book_id):
+                written[court_book_id] = writeback_court_book(client, court_book_id)
+        except RuntimeError as e:
+            print(f"ERROR: {e}")
+            failed_books.append(court_book_id)
+    if failed_books:
+        raise RuntimeError(f"Writeback incomplete for court book(s) {', '.join(failed_books)}; see the writeback reports")
+    return written
+
+if __name__ == "__main__":
+    main()
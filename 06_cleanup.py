@@ -1,17 +1,20 @@
 import os
+import re
 import glob
 import logging
 import shutil
-import zipfile
-import csv
+import time
+from supporting_files.archive_class import ArchiveStore
+from supporting_files.metrics_class import METRICS
+from supporting_files.log_sink_class import LOG_SINK
+from supporting_files.court_book_csv import read_court_book_ids
 
 # Constants
-CSV_FILE = "00_courtbooks_to_get.csv"
 OUTPUT_LOCATION = "outputs/"
 ARCHIVE_LOCATION = "run_scripts/processed/"
 PROGRESS_LOG = "run_scripts/progress.log"
-FILE_PATTERN = "*_part*.csv"
-ZIP_FILENAME_TEMPLATE = "{court_book_id}_archived_outputs.zip"
+MANIFEST_FILENAME_TEMPLATE = "{court_book_id}_{run_time}_manifest.json"
+BOOK_FILE_PATTERN = re.compile(r"^(\d+)_")  # Output files named <court book ID>_...
 
 # Logging Configuration
 logging.basicConfig(
@@ -19,38 +22,44 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-def zip_and_move_output(court_book_id):
-    """Zips all files in OUTPUT_LOCATION and moves the zip file to ARCHIVE_LOCATION."""
-    zip_filename = ZIP_FILENAME_TEMPLATE.format(court_book_id=court_book_id)
-    zip_path = os.path.join(ARCHIVE_LOCATION, zip_filename)
+def select_book_files(court_book_id, court_book_ids):
+    """Returns {name relative to OUTPUT_LOCATION: path} for a book's output files.
 
-    os.makedirs(ARCHIVE_LOCATION, exist_ok=True)
-
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for foldername, subfolders, filenames in os.walk(OUTPUT_LOCATION):
-            if foldername.startswith(ARCHIVE_LOCATION):
+    Files named after another listed book are left to that book; files not named after any listed
+    book (e.g. run_logs.csv) are shared and go into every book's archive.
+    """
+    other_books = set(map(str, court_book_ids)) - {str(court_book_id)}
+    files = {}
+    for foldername, _, filenames in os.walk(OUTPUT_LOCATION):
+        for filename in filenames:
+            match = BOOK_FILE_PATTERN.match(filename)
+            if match and match.group(1) in other_books:
                 continue
-            for filename in filenames:
-                file_path = os.path.join(foldername, filename)
-                if file_path != zip_path:
-                    zipf.write(file_path, os.path.relpath(file_path, OUTPUT_LOCATION))
-
-    logging.info(f"Zipped all output files for {court_book_id} → {zip_path}")
+            file_path = os.path.join(foldername, filename)
+            files[os.path.relpath(file_path, OUTPUT_LOCATION).replace(os.sep, "/")] = file_path
+    return files
 
-def cleanup_part_files():
-    """Deletes all CSV files with 'part' in the filename."""
-    part_files = glob.glob(os.path.join(OUTPUT_LOCATION, FILE_PATTERN))
+def archive_output(court_book_id, court_book_ids, run_time=None):
+    """Archives a book's output files into the content-addressed store in ARCHIVE_LOCATION.
 
-    if not part_files:
-        logging.info("No part files found for deletion.")
-        return
+    Files identical to ones archived before are not stored again; the run's manifest lists them all.
+    """
+    run_time = run_time or time.strftime("%Y%m%d_%H%M%S")
+    files = select_book_files(court_book_id, court_book_ids)
+    manifest_name = MANIFEST_FILENAME_TEMPLATE.format(court_book_id=court_book_id, run_time=run_time)
+    manifest_path, records = ArchiveStore(ARCHIVE_LOCATION).archive(
+        files, manifest_name, court_book_id=str(court_book_id), run_time=run_time
+    )
 
-    for file in part_files:
-        try:
-            os.remove(file)
-            logging.info(f"Deleted: {file}")
-        except Exception as e:
-            logging.error(f"Error deleting {file}: {e}")
+    stored = [record for record in records if record["stored"]]
+    METRICS.inc("archive_files_total", len(stored), result="stored")
+    METRICS.inc("archive_files_total", len(records) - len(stored), result="deduplicated")
+    METRICS.inc("archive_bytes_total", sum(record["size"] for record in stored), result="stored")
+    logging.info(
+        f"Archived {len(records)} output files for {court_book_id} ({len(stored)} new, "
+        f"{len(records) - len(stored)} already stored) → {manifest_path}"
+    )
+    return manifest_path
 
 def delete_output_contents():
     """Deletes all files in the OUTPUT_LOCATION after archiving."""
@@ -67,6 +76,7 @@ def delete_output_contents():
 
 def clear_progress_log():
     """Clears the contents of the progress log."""
+    LOG_SINK.flush()  # Write any queued progress lines first so they don't land after the clear
     try:
         with open(PROGRESS_LOG, 'w', encoding='utf-8') as f:
             f.write("")
@@ -74,17 +84,21 @@ def clear_progress_log():
     except Exception as e:
         logging.error(f"Failed to clear progress log: {e}")
 
-if __name__ == "__main__":
-    cleanup_part_files()
+def main(court_book_ids=None, clear_progress=True):
+    """Archives outputs for each court book, then clears the outputs folder and progress log.
 
-    with open(CSV_FILE, newline="") as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header
-        for row in reader:
-            if not row or not row[0].strip():
-                continue
-            court_book_id = row[0].strip()
-            zip_and_move_output(court_book_id)
+    clear_progress=False leaves the shared progress log alone (queue workers, whose runs overlap).
+    """
+    if court_book_ids is None:
+        court_book_ids = read_court_book_ids()
+    run_time = time.strftime("%Y%m%d_%H%M%S")
+    for court_book_id in court_book_ids:
+        with METRICS.timer("book_stage_seconds", stage="06", book=court_book_id):
+            archive_output(court_book_id, court_book_ids, run_time)
 
     delete_output_contents()
-    clear_progress_log()
+    if clear_progress:
+        clear_progress_log()
+
+if __name__ == "__main__":
+    main()
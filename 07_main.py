@@ -1,65 +1,218 @@
+import argparse
 import csv
-import subprocess
+import importlib
 import os
 import sys
+import time
 from datetime import datetime
 
 PROGRESS_LOG = r"\\V0050\05_CTP_chronology\run_scripts\progress.log"
+METRICS_LOCATION = "run_scripts/metrics/"  # Per-run metrics: JSON lines history plus latest Prometheus text file
+METRICS_FILE = "metrics.jsonl"
+PROMETHEUS_FILE = "pipeline.prom"
+PIPELINE_BOOKS = True  # Each book moves through stages 1-5 on its own; False runs each stage for all books before the next
+STAGE_WORKERS = {  # Books in each stage at once when pipelined
+    "extract": 2,
+    "generate": 2,  # Two books share the LLM throttle, so one's tail doesn't leave the endpoint idle
+    "post_process": 2,
+    "payload": 2,
+    "writeback": 1,
+}
 
 def log_progress(message):
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open(PROGRESS_LOG, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+    LOG_SINK.write(PROGRESS_LOG, f"{timestamp} {message}\n")
 
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.getcwd())  # Stage modules and supporting_files live next to this script
 
-csv_path = r"\\V0050\05_CTP_chronology\00_courtbooks_to_get.csv"
-
-with open(csv_path, mode="r", newline="", encoding="utf-8") as f:
-    reader = list(csv.reader(f))
-
-if len(reader) < 1:
-    log_progress("ERROR: CSV is missing data. Aborting.")
-    print("CSV is missing data.")
-    exit()
-
-log_progress("New entry detected in CSV. Starting processing pipeline.")
-print("New value detected running scripts...")
-
-print("Step 1: Extracting data and saving as csv")
-log_progress("Step 1: Extracting data...")
-
-try:
-    subprocess.run(["python", "01_webapp_extract_data.py"], check=True, timeout=30)
-except subprocess.TimeoutExpired:
-    log_progress("ERROR: Step 1 timed out after 30 seconds.")
-    print("ERROR: Step 1 (data extraction) timed out.")
-    sys.exit(1)
-except subprocess.CalledProcessError as e:
-    log_progress(f"ERROR: Step 1 failed with return code {e.returncode}.")
-    print(f"ERROR: Step 1 (data extraction) failed.")
-    sys.exit(1)
-
+from supporting_files.metrics_class import METRICS
+from supporting_files.log_sink_class import LOG_SINK
+from supporting_files.pipeline_class import BookPipeline
+from supporting_files.store_class import BookStore
 
-print("Step 2: Generating chronologies in chunks then merging")
-log_progress("Step 2: Generating chronologies...")
-subprocess.run(["python", "02_chronology_generate.py"], check=True)
-
-print("Step 3: Post processing the data")
-log_progress("Step 3: Post-processing data...")
-subprocess.run(["python", "03_post_process.py"], check=True)
-
-print("Step 4: Build the writeback payload")
-log_progress("Step 4: Creating writeback payload...")
-subprocess.run(["python", "04_create_payload.py"], check=True)
-
-print("Step 5: Writing back...")
-log_progress("Step 5: Writing data back...")
-subprocess.run(["python", "05_writeback.py"], check=True)
-
-print("Step 6: Cleanup and finish")
-log_progress("Step 6: Performing cleanup...")
-subprocess.run(["python", "06_cleanup.py"], check=True)
-
-print("All done.")
-log_progress("Processing complete.")
+csv_path = r"\\V0050\05_CTP_chronology\00_courtbooks_to_get.csv"
+stage_timings = []  # (step, label, seconds) for the run summary
+
+def load_stage(module_name):
+    """Imports a numbered stage script (e.g. 01_webapp_extract_data) as a module, or None if it doesn't exist."""
+    try:
+        return importlib.import_module(module_name)
+    except ModuleNotFoundError as e:
+        if e.name != module_name:
+            raise  # A dependency of the stage is missing, not the stage itself
+        return None
+
+def run_stage(step, label, func, *args, **kwargs):
+    """Runs one stage in-process, logging its duration. Exits the pipeline if the stage raises."""
+    print(f"Step {step}: {label}")
+    log_progress(f"Step {step}: {label}...")
+    start = time.perf_counter()
+    try:
+        with METRICS.timer("stage_duration_seconds", stage=f"{step:02d}" if isinstance(step, int) else step):
+            result = func(*args, **kwargs)
+    except Exception as e:
+        log_progress(f"ERROR: Step {step} failed: {e}")
+        print(f"ERROR: Step {step} ({label}) failed: {e}")
+        export_metrics()
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    print(f"Step {step} finished in {elapsed:.1f}s")
+    log_progress(f"Step {step} finished in {elapsed:.1f}s")
+    stage_timings.append((step, label, elapsed))
+    return result
+
+def export_metrics():
+    """Append this run's metrics to the JSON lines history and replace the Prometheus text file."""
+    try:
+        METRICS.write_json_lines(os.path.join(METRICS_LOCATION, METRICS_FILE))
+        METRICS.write_prometheus(os.path.join(METRICS_LOCATION, PROMETHEUS_FILE))
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+
+def only(court_book_id, value):
+    """{court_book_id: value} for a stage's in-memory hand-off, or None so the stage reads the store."""
+    return None if value is None else {court_book_id: value}
+
+def has_table(stage, court_book_id, table):
+    """Whether the book's store (in the stage's outputs folder) holds table, without creating a store."""
+    if court_book_id not in BookStore.list_books(stage.OUTPUT_LOCATION):
+        return False
+    with BookStore(stage.OUTPUT_LOCATION, court_book_id) as store:
+        return store.has_table(table)
+
+def build_pipeline(client, extract, generate, post_process, payload, writeback):
+    """Stages 1-5 as a per-book pipeline, each stage passing its in-memory result to the next.
+
+    The stages report problems and carry on rather than raising, so each step raises here when it
+    produced nothing for the book and nothing usable is in the book's store from an earlier run.
+    """
+    def extract_book(court_book_id, _):
+        courtbook = extract.main(client=client, court_book_ids=[court_book_id]).get(court_book_id)
+        if courtbook is None and not has_table(extract, court_book_id, "courtbook"):
+            raise RuntimeError("extraction failed or ran out of time")
+        return courtbook
+
+    def generate_book(court_book_id, courtbook):
+        generated = generate.main(llm=generate.llm_client, courtbooks=only(court_book_id, courtbook), court_book_ids=[court_book_id])
+        results = generated.get(court_book_id)
+        if results is None and not has_table(generate, court_book_id, "chronology"):
+            raise RuntimeError("no chronology was generated")
+        return results
+
+    def post_process_book(court_book_id, results):
+        chronology = post_process.concatenate_parts(parts=only(court_book_id, results), court_book_ids=[court_book_id]).get(court_book_id)
+        if chronology is None and not has_table(post_process, court_book_id, "chronology"):
+            raise RuntimeError("no generated responses to post-process")
+        return chronology
+
+    def payload_book(court_book_id, chronology):
+        payloads = payload.main(client=client, court_book_ids=[court_book_id], chronologies=only(court_book_id, chronology))
+        if court_book_id not in payloads:
+            raise RuntimeError("no writeback payload was created")
+
+    def writeback_book(court_book_id, _):
+        return writeback.main(client=client, court_book_ids=[court_book_id]).get(court_book_id)
+
+    stages = [
+        ("extract", extract_book, STAGE_WORKERS["extract"]),
+        ("generate", generate_book, STAGE_WORKERS["generate"]),
+        ("post_process", post_process_book, STAGE_WORKERS["post_process"]),
+        ("payload", payload_book, STAGE_WORKERS["payload"]),
+    ]
+    if writeback is not None:
+        stages.append(("writeback", writeback_book, STAGE_WORKERS["writeback"]))
+    return BookPipeline(stages, log=log_progress)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Runs the chronology pipeline for the court books listed in the CSV.")
+    parser.add_argument("court_book_ids", nargs="*", help="court books to process instead of those in the CSV")
+    parser.add_argument("--outputs", help="outputs folder for this run (queue workers use one per job so runs don't share outputs/)")
+    parser.add_argument("--state", help="entry state folder (queue workers keep their own rather than share state/)")
+    return parser.parse_args()
+
+def main(court_book_ids=None, output_location=None, state_location=None):
+    """Runs every stage for court_book_ids (default: the IDs in the CSV), optionally with its own outputs and state folders.
+
+    Exits with 1 unless every book finished stages 1-5.
+    """
+    METRICS.reset()
+    if not court_book_ids:
+        with open(csv_path, mode="r", newline="", encoding="utf-8") as f:
+            reader = list(csv.reader(f))
+
+        if len(reader) < 1:
+            log_progress("ERROR: CSV is missing data. Aborting.")
+            print("CSV is missing data.")
+            exit()
+
+        court_book_ids = [row[0].strip() for row in reader[1:] if row and row[0].strip()]
+    METRICS.set("run_books", len(court_book_ids))
+
+    log_progress("New entry detected in CSV. Starting processing pipeline.")
+    print("New value detected running scripts...")
+
+    # Import every stage once; pandas/bs4/openpyxl are loaded a single time for the whole run
+    extract = load_stage("01_webapp_extract_data")
+    generate = load_stage("02_chronology_generate")
+    post_process = load_stage("03_post_process")
+    payload = load_stage("04_create_payload")
+    writeback = load_stage("05_writeback")
+    cleanup = load_stage("06_cleanup")
+
+    if output_location:
+        # The response cache and the archive use atomic file renames, so they stay shared next to this script
+        for stage in (extract, post_process, payload, writeback, cleanup):
+            if stage is not None:
+                stage.OUTPUT_LOCATION = output_location
+        generate.set_output_location(output_location)
+    if state_location:
+        # Entry state is SQLite, which can't be safely shared between machines over the network share
+        extract.STATE_LOCATION = generate.STATE_LOCATION = state_location
+
+    # One authenticated webapp session shared by extraction, payload and writeback
+    from supporting_files.webapp_class import APIClient
+    client = APIClient(extract.BASE_URL, extract.LOGIN_PAGE_URL, extract.LOGIN_URL)
+    if not client.authenticate():
+        log_progress("❌ ERROR: Authentication failed. Exiting.")
+        print("Authentication failed. Exiting.")
+        sys.exit(1)
+
+    if writeback is None:
+        print("Step 5: Skipped - 05_writeback.py not found")
+        log_progress("Step 5: Skipped - writeback stage not available.")
+
+    if PIPELINE_BOOKS:
+        pipeline = build_pipeline(client, extract, generate, post_process, payload, writeback)
+        _, failures = run_stage("1-5", "Processing books through stages 1-5", pipeline.run, court_book_ids)
+        if failures:
+            for court_book_id, (stage, error) in failures.items():
+                print(f"ERROR: Court book {court_book_id} failed in {stage}: {error}")
+            log_progress(f"ERROR: {len(failures)} court book(s) failed; outputs kept for a rerun.")
+            export_metrics()
+            sys.exit(1)
+    else:
+        courtbooks = run_stage(1, "Extracting data", extract.main, client=client, court_book_ids=court_book_ids)
+        generated = run_stage(2, "Generating chronologies", generate.main, llm=generate.llm_client, courtbooks=courtbooks)
+        chronologies = run_stage(3, "Post-processing data", post_process.concatenate_parts, parts=generated)
+        payloads = run_stage(4, "Creating writeback payload", payload.main, client=client, court_book_ids=court_book_ids, chronologies=chronologies)
+        missing = [court_book_id for court_book_id in court_book_ids if court_book_id not in payloads]
+        if missing:
+            print(f"ERROR: No writeback payload for court book(s) {', '.join(missing)}")
+            log_progress(f"ERROR: {len(missing)} court book(s) failed; outputs kept for a rerun.")
+            export_metrics()
+            sys.exit(1)
+        if writeback is not None:
+            run_stage(5, "Writing data back", writeback.main, client=client, court_book_ids=court_book_ids)
+
+    run_stage(6, "Performing cleanup", cleanup.main, court_book_ids=court_book_ids, clear_progress=not output_location)
+
+    summary = ", ".join(f"step {step} {elapsed:.1f}s" for step, _, elapsed in stage_timings)
+    METRICS.event("run_complete", books=len(court_book_ids), duration=round(sum(elapsed for _, _, elapsed in stage_timings), 4))
+    export_metrics()
+    print(f"All done. ({summary})")
+    log_progress(f"Processing complete. ({summary})")
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.court_book_ids, args.outputs, args.state)
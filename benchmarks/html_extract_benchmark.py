@@ -0,0 +1,102 @@
+"""Times stage 1 HTML cleaning: the old BeautifulSoup path against the single-pass extractor.
+
+Run from the repository root: python benchmarks/html_extract_benchmark.py
+"""
+import os
+import random
+import sys
+import time
+from html import unescape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from supporting_files.html_text_class import HTMLTextExtractor, etree
+
+ENTRY_COUNT = 2000  # Entries per run, roughly a large OCR'd court book
+PARAGRAPHS_PER_ENTRY = (3, 40)
+REPEATS = 3
+SEED = 42
+
+WORDS = ("patient reviewed pain medication report clinical history assessment noted plan follow "
+         "up review injury left right shoulder back surgery imaging MRI x-ray specialist referral").split()
+
+
+def make_entry(rng):
+    """Build one entryOriginal/entryFinal pair shaped like the webapp's OCR output."""
+    paragraphs = []
+    for _ in range(rng.randint(*PARAGRAPHS_PER_ENTRY)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 60))]
+        if rng.random() < 0.3:
+            words[rng.randrange(len(words))] = f"<b>{rng.choice(WORDS).upper()}</b>"
+        if rng.random() < 0.2:
+            words.append("&amp; Co &lt;3&gt; &#233;")
+        paragraphs.append(f"<p>{' '.join(words).capitalize()}.</p>")
+    if rng.random() < 0.3:
+        paragraphs.insert(0, "<p>&nbsp;</p>")
+    body = "\n".join(paragraphs)
+    return {"entryOriginal": f"<div class=\"page\">{body}</div>", "entryFinal": body}
+
+
+def legacy_clean(entry):
+    """The previous stage 1 path: three BeautifulSoup parses per entry."""
+    def clean_html(html_content):
+        if not html_content:
+            return ""
+        soup = BeautifulSoup(html_content, "html.parser")
+        return unescape(soup.get_text(separator=" ", strip=True))
+
+    def extract_first_line(text, max_length=80):
+        if not text:
+            return "-"
+        for p in BeautifulSoup(text, "html.parser").find_all("p"):
+            clean_text = p.get_text(strip=True)
+            if clean_text:
+                return (clean_text[:max_length] + "...") if len(clean_text) > max_length else clean_text
+        return "-"
+
+    return clean_html(entry["entryOriginal"]), clean_html(entry["entryFinal"]), extract_first_line(entry["entryFinal"])
+
+
+def single_pass_clean(extractor):
+    def clean(entry):
+        original, _, _ = extractor.extract(entry["entryOriginal"])
+        modified, first_paragraph, _ = extractor.extract(entry["entryFinal"])
+        return original, modified, HTMLTextExtractor.first_line(first_paragraph)
+    return clean
+
+
+def time_path(clean, entries):
+    """Best-of-REPEATS wall time and the outputs of the last run."""
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        outputs = [clean(entry) for entry in entries]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, outputs
+
+
+def main():
+    rng = random.Random(SEED)
+    entries = [make_entry(rng) for _ in range(ENTRY_COUNT)]
+    size_mb = sum(len(entry["entryOriginal"]) + len(entry["entryFinal"]) for entry in entries) / 1024 / 1024
+    print(f"{ENTRY_COUNT} entries, {size_mb:.1f} MB of HTML, best of {REPEATS}")
+
+    baseline, expected = time_path(legacy_clean, entries)
+    print(f"{'BeautifulSoup (3 parses)':<28} {baseline:7.2f}s")
+
+    paths = [("html.parser single pass", HTMLTextExtractor(use_lxml=False))]
+    if etree is not None:
+        paths.append(("lxml single pass", HTMLTextExtractor(use_lxml=True)))
+    else:
+        print("lxml not installed; skipping the lxml backend")
+
+    for label, extractor in paths:
+        elapsed, outputs = time_path(single_pass_clean(extractor), entries)
+        mismatches = sum(1 for got, want in zip(outputs, expected) if got != want)
+        print(f"{label:<28} {elapsed:7.2f}s  {baseline / elapsed:5.1f}x  {mismatches} mismatched entries")
+
+
+if __name__ == "__main__":
+    main()
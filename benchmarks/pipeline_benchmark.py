@@ -0,0 +1,197 @@
+"""Times stages 01-05 against local stand-ins for the webapp and sparkechat, on synthetic court books.
+
+Run from the repository root, e.g.:
+    python benchmarks/pipeline_benchmark.py --books 3 --entries 500 --chat-latency 0.2 --error-rate 0.02
+
+The first run starts from empty outputs/, state/ and cache/ folders. Later runs (--runs) clear outputs/
+like 06_cleanup does but keep state/ and cache/, so they measure the unchanged-book path.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_in_servers import ChatServer, WebappServer
+from synthetic_books import BookSpec, generate_book
+
+FIRST_BOOK_ID = 9001
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=2, help="court books to generate")
+    parser.add_argument("--entries", type=int, default=200, help="entries per court book")
+    parser.add_argument("--paragraphs", type=int, nargs=2, default=(3, 30), metavar=("MIN", "MAX"), help="paragraphs per entry")
+    parser.add_argument("--words", type=int, nargs=2, default=(10, 80), metavar=("MIN", "MAX"), help="words per paragraph")
+    parser.add_argument("--handwritten-ratio", type=float, default=0.05)
+    parser.add_argument("--relevant-ratio", type=float, default=0.9)
+    parser.add_argument("--web-latency", type=float, default=0.0, help="seconds added to each webapp request")
+    parser.add_argument("--chat-latency", type=float, default=0.05, help="seconds before each chat response starts")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chat tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of chat requests answered with 503")
+    parser.add_argument("--web-error-rate", type=float, default=0.0, help="fraction of webapp API requests answered with 503")
+    parser.add_argument("--max-put-entries", type=int, help="webapp rejects PUTs with more entries than this (413)")
+    parser.add_argument("--llm-rate", type=float, help="override the LLM requests-per-second limit (default: production setting)")
+    parser.add_argument("--pipelined", action="store_true", help="run books through stages 01-05 with 07_main's per-book pipeline")
+    parser.add_argument("--runs", type=int, default=1, help="pipeline runs; runs after the first reuse state/ and cache/")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working folder")
+    parser.add_argument("--verbose", action="store_true", help="show stage output")
+    return parser.parse_args()
+
+
+def prepare_workdir():
+    """A scratch copy of what the stages expect next to them: outputs/ and the prompt list."""
+    workdir = tempfile.mkdtemp(prefix="ctp_benchmark_")
+    os.makedirs(os.path.join(workdir, "outputs"))
+    os.makedirs(os.path.join(workdir, "supporting_files"))
+    shutil.copy(os.path.join(REPO_ROOT, "supporting_files", "prompt_list.csv"), os.path.join(workdir, "supporting_files"))
+    return workdir
+
+
+def load_stages(web_url, chat_url, workdir, llm_rate=None):
+    """Import stages 01-05 with their service URLs and log paths pointed at the stand-ins and workdir."""
+    os.environ.setdefault("USER", "benchmark")
+    os.environ.setdefault("PASSWORD", "benchmark")
+    os.environ.setdefault("BREW_USERNAME", "benchmark")
+    os.environ.setdefault("BREW_EMAIL", "benchmark@example.com")
+    os.environ.setdefault("BREW_PASSWORD", "benchmark")
+
+    from supporting_files import llm_class
+    llm_class.BASE_URL = chat_url
+    if llm_rate:
+        llm_class.THROTTLE.bucket.rate = llm_rate
+        llm_class.THROTTLE.bucket.capacity = max(llm_class.THROTTLE.bucket.capacity, llm_rate)
+
+    stages = {
+        "extract": importlib.import_module("01_webapp_extract_data"),
+        "generate": importlib.import_module("02_chronology_generate"),
+        "post_process": importlib.import_module("03_post_process"),
+        "payload": importlib.import_module("04_create_payload"),
+        "writeback": importlib.import_module("05_writeback"),
+        "orchestrator": importlib.import_module("07_main"),
+    }
+    os.chdir(workdir)  # 07_main moves to the repository root when imported
+    stages["orchestrator"].PROGRESS_LOG = os.path.join(workdir, "progress.log")
+    for module in (stages["extract"], stages["writeback"]):
+        module.PROGRESS_LOG = os.path.join(workdir, "progress.log")
+    for module in (stages["extract"], stages["payload"], stages["writeback"]):
+        module.BASE_URL = web_url
+    return stages, llm_class
+
+
+def timed(label, timings, quiet, func, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        result = func(*args, **kwargs)
+    timings[label] = time.perf_counter() - start
+    return result
+
+
+def run_pipeline(stages, client, court_book_ids, quiet, pipelined=False):
+    """One pass of stages 01-05, returning {stage: seconds}."""
+    timings = {}
+    if pipelined:
+        pipeline = stages["orchestrator"].build_pipeline(
+            client, stages["extract"], stages["generate"], stages["post_process"], stages["payload"], stages["writeback"]
+        )
+        _, failures = timed("01-05_pipelined", timings, quiet, pipeline.run, court_book_ids)
+        if failures:
+            raise SystemExit(f"Pipeline failures: {failures}")
+        return timings
+    courtbooks = timed("01_extract", timings, quiet, stages["extract"].main, client=client, court_book_ids=court_book_ids)
+    generated = timed("02_generate", timings, quiet, stages["generate"].main, courtbooks=courtbooks)
+    chronologies = timed("03_post_process", timings, quiet, stages["post_process"].concatenate_parts, parts=generated)
+    timed("04_payload", timings, quiet, stages["payload"].main, client=client, court_book_ids=court_book_ids, chronologies=chronologies)
+    timed("05_writeback", timings, quiet, stages["writeback"].main, client=client, court_book_ids=court_book_ids)
+    return timings
+
+
+def print_report(report):
+    stages = list(report["runs"][0]["timings"])
+    print(f"\n{'run':<5}" + "".join(f"{stage:>17}" for stage in stages) + f"{'total':>10}{'LLM reqs':>10}{'retries':>9}")
+    for index, run in enumerate(report["runs"], start=1):
+        timings = run["timings"]
+        print(f"{index:<5}" + "".join(f"{timings[stage]:>16.2f}s" for stage in stages)
+              + f"{sum(timings.values()):>9.2f}s{run['llm_requests']:>10}{run['llm_retries']:>9}")
+    print(f"\nbooks={report['config']['books']} entries/book={report['config']['entries']} "
+          f"chat requests served={report['chat_server']['requests']} (injected errors {report['chat_server']['errors']})")
+
+
+def main():
+    args = parse_args()
+    spec = BookSpec(
+        entries=args.entries,
+        paragraphs=tuple(args.paragraphs),
+        words_per_paragraph=tuple(args.words),
+        handwritten_ratio=args.handwritten_ratio,
+        relevant_ratio=args.relevant_ratio,
+        seed=args.seed,
+    )
+    court_book_ids = [str(FIRST_BOOK_ID + index) for index in range(args.books)]
+    books = {court_book_id: generate_book(court_book_id, spec) for court_book_id in court_book_ids}
+
+    web = WebappServer(books, max_put_entries=args.max_put_entries, latency=args.web_latency,
+                       error_rate=args.web_error_rate, seed=args.seed).start()
+    chat = ChatServer(latency=args.chat_latency, token_delay=args.token_delay, error_rate=args.error_rate, seed=args.seed).start()
+    workdir = prepare_workdir()
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    report = {"config": vars(args), "runs": []}
+    try:
+        stages, llm_class = load_stages(web.url, chat.url, workdir, args.llm_rate)
+        from supporting_files.webapp_class import APIClient
+        client = APIClient(web.url, f"{web.url}/login", f"{web.url}/j_security_check")
+        if not client.authenticate():
+            raise SystemExit("Could not authenticate with the stand-in webapp")
+
+        for run in range(args.runs):
+            if run:
+                shutil.rmtree("outputs")
+                os.makedirs("outputs")
+            requests_before, retries_before = llm_class.THROTTLE.requests, llm_class.THROTTLE.retries
+            timings = run_pipeline(stages, client, court_book_ids, quiet=not args.verbose, pipelined=args.pipelined)
+            report["runs"].append({
+                "timings": timings,
+                "llm_requests": llm_class.THROTTLE.requests - requests_before,
+                "llm_retries": llm_class.THROTTLE.retries - retries_before,
+            })
+        from supporting_files.metrics_class import METRICS
+        report["metrics"] = METRICS.snapshot()
+        report["chat_server"] = dict(chat.counts)
+        report["webapp_server"] = dict(web.counts, puts=len(web.puts))
+    finally:
+        from supporting_files.log_sink_class import LOG_SINK
+        LOG_SINK.flush()  # Buffered lines use paths relative to the working folder
+        os.chdir(original_cwd)
+        logging.disable(logging.NOTSET)
+        web.stop()
+        chat.stop()
+        if args.keep:
+            print(f"Working folder kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Local stand-ins for the Sparke webapp and the sparkechat summary API, for offline benchmarking.
+
+Both servers listen on 127.0.0.1 on a free port and run in background threads. Latency and error
+injection are set per server so the pipeline's retry and throttling paths can be exercised.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOOK_PATH = re.compile(r"^/sparke/api/v0/books/(\d+)/chronology/(bookitems/)?$")
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Threaded HTTP server with injectable latency and error responses."""
+
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, error_rate=0.0, error_status=503, seed=0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency  # Seconds added before each response
+        self.error_rate = error_rate  # Fraction of requests answered with error_status
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counts = {"requests": 0, "errors": 0}
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def should_fail(self):
+        with self.rng_lock:
+            self.counts["requests"] += 1
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.counts["errors"] += 1
+        return failed
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, as the real servers allow
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def injected_failure(self):
+        """Apply the server's latency, then answer with an error if this request is chosen to fail."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self.send_body({"error": "injected"}, status=self.server.error_status, headers={"Retry-After": "1"})
+            return True
+        return False
+
+
+class WebappHandler(StandInHandler):
+    """Login pages, /chronology/ and /chronology/bookitems/ (with ETag support) and chronology PUTs."""
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        match = BOOK_PATH.match(path)
+        if not match:
+            self.send_body(b"<html>login</html>", content_type="text/html")
+            return
+        if self.injected_failure():
+            return
+
+        court_book_id, is_items = match.group(1), match.group(2)
+        book = self.server.books.get(court_book_id)
+        if book is None:
+            self.send_body({"error": "not found"}, status=404)
+            return
+        body = book["items_body"] if is_items else book["entries_body"]
+        etag = book["items_etag"] if is_items else book["entries_etag"]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_body(body, headers={"ETag": etag})
+
+    def do_POST(self):
+        self.read_body()
+        self.send_body(b"<html>welcome</html>", content_type="text/html")
+
+    def do_PUT(self):
+        body = self.read_body()
+        if self.injected_failure():
+            return
+        entries = json.loads(body or b"[]")
+        if self.server.max_put_entries and isinstance(entries, list) and len(entries) > self.server.max_put_entries:
+            self.send_body({"error": "payload too large"}, status=413)
+            return
+        with self.server.rng_lock:
+            self.server.puts.append((self.path, len(body)))
+        self.send_body({"status": "ok"})
+
+
+class WebappServer(StandInServer):
+    def __init__(self, books=None, max_put_entries=None, **kwargs):
+        super().__init__(WebappHandler, **kwargs)
+        self.books = {}
+        self.puts = []
+        self.max_put_entries = max_put_entries  # Larger PUTs are rejected with 413
+        for court_book_id, (entries, book_items) in (books or {}).items():
+            self.add_book(court_book_id, entries, book_items)
+
+    def add_book(self, court_book_id, entries, book_items):
+        """Serve a book's entries and items; bodies are encoded once so serving cost stays out of the timings."""
+        entries_body = json.dumps(entries).encode("utf-8")
+        items_body = json.dumps(book_items).encode("utf-8")
+        self.books[str(court_book_id)] = {
+            "entries_body": entries_body,
+            "entries_etag": '"%s"' % hashlib.sha256(entries_body).hexdigest()[:16],
+            "items_body": items_body,
+            "items_etag": '"%s"' % hashlib.sha256(items_body).hexdigest()[:16],
+        }
+
+
+class ChatHandler(StandInHandler):
+    """Access tokens and the /chat-summary/chat/ server-sent event stream."""
+
+    def do_GET(self):
+        if self.path.startswith("/api/v1/shared/access-token"):
+            self.send_body({"accessToken": "stand-in-token"})
+        else:
+            self.send_body({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self.read_body()
+        if not self.path.startswith("/api/v1/chat-summary/chat/"):
+            self.send_body({"error": "not found"}, status=404)
+            return
+        if self.injected_failure():
+            return
+
+        text = json.loads(body or b"{}").get("text", "")
+        tokens = self.server.summary_tokens(text)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")  # Stream length isn't known up front
+        self.end_headers()
+        self.close_connection = True
+        for token in tokens:
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            self.wfile.write(f"data: {json.dumps({'content': token})}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+class ChatServer(StandInServer):
+    def __init__(self, token_delay=0.0, **kwargs):
+        super().__init__(ChatHandler, **kwargs)
+        self.token_delay = token_delay  # Seconds between streamed tokens
+
+    @staticmethod
+    def summary_tokens(text):
+        """A short, deterministic bullet summary of text, split into streamed tokens."""
+        words = re.findall(r"[A-Za-z]+", text)
+        heading = " ".join(words[:4]).upper() or "EMPTY ENTRY"
+        bullets = [" ".join(words[start:start + 8]) for start in range(0, min(len(words), 40), 8)]
+        summary = f"AI SUMMARY: {heading}\n" + "\n".join(f"* {bullet}" for bullet in bullets)
+        return re.findall(r"\S+\s*", summary)
@@ -0,0 +1,60 @@
+"""Synthetic court books shaped like the webapp's /chronology/ and /bookitems/ responses."""
+import random
+import time
+from dataclasses import dataclass
+
+WORDS = ("patient reviewed pain medication report clinical history assessment noted plan follow up review "
+         "injury left right shoulder back surgery imaging MRI x-ray specialist referral physiotherapy GP "
+         "workers compensation claim capacity restricted duties psychologist anxiety depression sleep").split()
+DOCUMENT_TYPES = ["Report", "Letter", "Clinical Notes", "Certificate of Capacity", "Referral", "Imaging"]
+
+
+@dataclass
+class BookSpec:
+    """Size and shape of a generated court book."""
+    entries: int = 200
+    paragraphs: tuple = (3, 30)  # Paragraphs per entry (min, max)
+    words_per_paragraph: tuple = (10, 80)
+    handwritten_ratio: float = 0.05
+    relevant_ratio: float = 0.9
+    book_items: int = 20
+    seed: int = 42
+
+
+def make_paragraphs(rng, spec):
+    paragraphs = []
+    for _ in range(rng.randint(*spec.paragraphs)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(*spec.words_per_paragraph))]
+        if rng.random() < 0.3:
+            words[rng.randrange(len(words))] = f"<b>{rng.choice(WORDS).upper()}</b>"
+        if rng.random() < 0.1:
+            words.append("&amp; co &lt;see attached&gt;")
+        paragraphs.append(f"<p>{' '.join(words).capitalize()}.</p>")
+    return paragraphs
+
+
+def generate_book(court_book_id, spec=None):
+    """Return (chronology entries, book items) for a synthetic court book."""
+    spec = spec or BookSpec()
+    rng = random.Random(f"{spec.seed}-{court_book_id}")
+    book_items = [
+        {"id": 1000 + index, "description": f"{rng.choice(DOCUMENT_TYPES)} {index}.pdf"}
+        for index in range(spec.book_items)
+    ]
+
+    start = int(time.mktime((2019, 1, 1, 0, 0, 0, 0, 0, -1)) * 1000)
+    entries = []
+    for index in range(spec.entries):
+        heading = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).upper()
+        body = "".join(make_paragraphs(rng, spec))
+        entries.append({
+            "id": int(court_book_id) * 100000 + index,
+            "courtBookId": int(court_book_id),
+            "bookItemId": rng.choice(book_items)["id"],
+            "entryDate": start + index * 86400000,
+            "handwritten": "true" if rng.random() < spec.handwritten_ratio else "false",
+            "relevant": "Relevant" if rng.random() < spec.relevant_ratio else "Not Relevant",
+            "entryOriginal": f"<div class=\"page\">{body}</div>",
+            "entryFinal": f"<p>{heading}</p>{body}",
+        })
+    return entries, book_items
@@ -130,12 +130,12 @@ for %%F in (%folder_to_poll%\*) do (
         
     )
 
-    REM Move the .zip file to the archived folder
-    move "%folder_to_poll%\*.zip" "%folder_to_poll%\archived\" >nul 2>&1
+    REM Move the run manifests to the archived folder (file contents stay in processed\blobs)
+    move "%folder_to_poll%\*_manifest.json" "%folder_to_poll%\archived\" >nul 2>&1
 
     echo.
     echo Process completed successfully.
-    echo Archive complete: ZIP file moved to 'processed/archived'.
+    echo Archive complete: manifest moved to 'processed/archived'.
 
     pause
     goto menu
@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import concurrent.futures
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing
+COMPRESS_LEVEL = 6  # gzip level; higher levels cost far more time for little gain on these files
+MAX_ARCHIVE_WORKERS = 4  # Files hashed and compressed in parallel
+
+
+class ArchiveStore:
+    """Content-addressed archive of output files.
+
+    Each unique file is stored once as blobs/<hash[:2]>/<hash>.gz under the archive root, however
+    many runs or books produce it. A run is recorded as a JSON manifest listing each archived file's
+    name, size and content hash; restore() rebuilds the files from a manifest.
+    """
+
+    def __init__(self, root, workers=MAX_ARCHIVE_WORKERS, compress_level=COMPRESS_LEVEL):
+        self.root = root
+        self.workers = workers
+        self.compress_level = compress_level
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.root, "blobs", content_hash[:2], f"{content_hash}.gz")
+
+    def put(self, path, name=None):
+        """Store one file unless an identical blob already exists. Returns its manifest record."""
+        content_hash = self.file_hash(path)
+        blob_path = self.blob_path(content_hash)
+        stored = not os.path.exists(blob_path)
+        if stored:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(path, "rb") as source, gzip.open(tmp_path, "wb", compresslevel=self.compress_level) as target:
+                shutil.copyfileobj(source, target, HASH_CHUNK_SIZE)
+            os.replace(tmp_path, blob_path)  # Atomic, so a blob is never seen half written
+        return {
+            "name": name or os.path.basename(path),
+            "size": os.path.getsize(path),
+            "sha256": content_hash,
+            "blob": os.path.relpath(blob_path, self.root).replace(os.sep, "/"),
+            "stored": stored,
+        }
+
+    def archive(self, files, manifest_name, **details):
+        """Store files ({name: path}) in parallel and write a manifest for them. Returns (manifest path, records)."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            records = list(executor.map(self.put, files.values(), files.keys()))
+
+        manifest = dict(details, created=time.strftime("%Y-%m-%d %H:%M:%S"), files=records)
+        manifest_path = os.path.join(self.root, manifest_name)
+        tmp_path = os.path.join(self.root, "blobs", f"{manifest_name}.tmp")  # Out of sight of anything polling root
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, manifest_path)
+        return manifest_path, records
+
+    def restore(self, manifest_path, destination):
+        """Rebuild the files listed in a manifest into destination. Returns the restored paths."""
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        os.makedirs(destination, exist_ok=True)
+        restored = []
+        for record in manifest["files"]:
+            target_path = os.path.join(destination, record["name"])
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with gzip.open(os.path.join(self.root, record["blob"]), "rb") as source, open(target_path, "wb") as target:
+                shutil.copyfileobj(source, target, HASH_CHUNK_SIZE)
+            restored.append(target_path)
+        return restored
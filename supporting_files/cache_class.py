@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from supporting_files.metrics_class import METRICS
+
+INDEX_FILE = "size_index.json"  # Last known total size, so opening the cache doesn't walk every file
+EVICT_TARGET = 0.9  # Eviction stops once the cache is under this fraction of max_bytes
+
+class ResponseCache:
+    """Persistent on-disk cache of LLM responses keyed by a hash of the request content.
+
+    The cache may sit on a network share used by several machines, so the total size is read from a
+    small index file instead of being measured on open. The files are only walked by a background
+    thread: once when there is no index yet, and whenever this process's running total goes over
+    max_bytes, at which point least recently used responses are evicted and the index is rewritten.
+    Writers never wait for a walk.
+    """
+
+    def __init__(self, location, max_bytes=200 * 1024 * 1024):
+        self.location = location
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.scan_thread = None  # Background walk/eviction, if one is running
+        self.written_during_scan = 0  # Bytes put while a walk runs, added to its result
+        os.makedirs(self.location, exist_ok=True)
+        self.total_bytes = self._load_index()
+        if self.total_bytes is None:
+            self.total_bytes = 0
+            self._start_scan()
+
+    @staticmethod
+    def make_key(text, prompt, meta_prompt):
+        """Build a content-addressed key from the entry text, prompt and meta prompt."""
+        digest = hashlib.sha256()
+        for part in (text, prompt, meta_prompt):
+            encoded = str(part).encode("utf-8")
+            digest.update(len(encoded).to_bytes(8, "big"))  # Length prefix keeps field boundaries unambiguous
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.location, key[:2], f"{key}.json")
+
+    def _tmp_path(self, path):
+        return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"  # Unique across threads and machines
+
+    def _entries(self):
+        """List (path, last used, size) for every cached response.
+
+        os.scandir returns sizes and times from the directory listing on Windows, so a share is not
+        stat'ed file by file.
+        """
+        entries = []
+        try:
+            folders = [entry.path for entry in os.scandir(self.location) if entry.is_dir()]
+        except OSError:
+            return entries
+        for folder in folders:
+            try:
+                with os.scandir(folder) as files:
+                    for entry in files:
+                        if not entry.name.endswith(".json"):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((entry.path, stat.st_mtime, stat.st_size))
+            except OSError:
+                continue
+        return entries
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.location, INDEX_FILE), "r", encoding="utf-8") as file:
+                return int(json.load(file)["total_bytes"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_index(self):
+        """Record the current total size for the next run to start from."""
+        path = os.path.join(self.location, INDEX_FILE)
+        tmp_path = self._tmp_path(path)
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"total_bytes": self.total_bytes, "updated": time.time()}, file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save the LLM cache size index: {e}")
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                response = json.load(file).get("response")
+            os.utime(path)  # Mark as recently used for eviction
+        except (OSError, ValueError):
+            response = None
+
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        METRICS.inc("llm_cache_lookups_total", result="miss" if response is None else "hit")
+        return response
+
+    def put(self, key, response):
+        """Store a response, starting a background eviction if the cache has grown over its size limit."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = self._tmp_path(path)
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"response": response, "created": time.time()}, file, ensure_ascii=False)
+        try:
+            previous_size = os.path.getsize(path)
+        except OSError:
+            previous_size = 0
+        try:
+            os.replace(tmp_path, path)  # Atomic so concurrent readers never see a partial file
+        except OSError:
+            os.remove(tmp_path)
+            raise
+        added = os.path.getsize(path) - previous_size
+
+        with self.lock:
+            self.total_bytes += added
+            self.written_during_scan += added
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self._start_scan()
+
+    def _start_scan(self):
+        """Walk the cache (and evict if over the limit) on a background thread, unless one is already running."""
+        with self.lock:
+            if self.scan_thread is not None and self.scan_thread.is_alive():
+                return
+            self.written_during_scan = 0
+            self.scan_thread = threading.Thread(target=self._evict, name="llm-cache-evict", daemon=True)
+            self.scan_thread.start()
+
+    def _evict(self):
+        """Measure the cache and remove least recently used entries until it is under EVICT_TARGET of max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * EVICT_TARGET
+        if total > self.max_bytes:
+            for path, _, size in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        with self.lock:
+            self.total_bytes = total + self.written_during_scan
+        self.save_index()
+
+    def summary(self):
+        """Return a one-line summary of cache usage for the run."""
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0
+        return f"LLM cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate), about {self.total_bytes / 1024 / 1024:.1f} MB on disk"
@@ -0,0 +1,121 @@
+import math
+import re
+
+try:
+    import tiktoken  # Optional: exact counts when available
+except ImportError:
+    tiktoken = None
+
+# Approximates the BPE pre-tokenizer: letter runs, digit runs, punctuation runs, newlines
+PIECE_PATTERN = re.compile(r"[^\W\d_]+|\d+|[^\w\s]+|\n+")
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?;:])\s+(?=[\"'(\[]?[A-Z0-9])")
+SHORT_WORD_LENGTH = 8  # Letter runs up to this long are nearly always a single token
+
+
+class TextChunker:
+    """Splits text into chunks under a token limit, keeping sentences intact where possible."""
+
+    def __init__(self, token_limit, encoding_name="cl100k_base"):
+        self.token_limit = token_limit
+        self.encoding = None
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.get_encoding(encoding_name)
+            except Exception:
+                self.encoding = None  # Encoding files unavailable offline; fall back to the estimator
+
+    def count_tokens(self, text):
+        """Count tokens with tiktoken if installed, otherwise estimate them the way a BPE tokenizer splits text."""
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+
+        tokens = 0
+        for piece in PIECE_PATTERN.findall(text):
+            first = piece[0]
+            if first.isdigit():
+                tokens += math.ceil(len(piece) / 3)  # Numbers are split into groups of up to 3 digits
+            elif first.isalpha():
+                # Common words are 1 token; longer (often rarer) terms split into a few pieces
+                tokens += 1 if len(piece) <= SHORT_WORD_LENGTH else math.ceil(len(piece) / 5)
+            elif first == "\n":
+                tokens += 1
+            else:
+                tokens += len(piece)  # Punctuation and symbols rarely merge
+        return tokens
+
+    def split(self, text):
+        """Split text into chunks of at most token_limit tokens, filling each chunk as far as possible."""
+        if not text or not text.strip():
+            return [""]
+        if self.count_tokens(text) <= self.token_limit:
+            return [text.strip()]
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for unit in SENTENCE_END_PATTERN.split(text.strip()):
+            if not unit:
+                continue
+            unit_tokens = self.count_tokens(unit)
+            if unit_tokens > self.token_limit:
+                # A single sentence over the limit: flush, then split it on word boundaries
+                if current:
+                    chunks.append("".join(current).strip())
+                    current, current_tokens = [], 0
+                chunks.extend(self._split_words(unit))
+                continue
+
+            joined_tokens = unit_tokens + (self.count_tokens(" ") if current else 0)
+            if current and current_tokens + joined_tokens > self.token_limit:
+                chunks.append("".join(current).strip())
+                current, current_tokens = [], 0
+                joined_tokens = unit_tokens
+
+            if current:
+                current.append(" ")
+            current.append(unit)
+            current_tokens += joined_tokens
+
+        if current:
+            chunks.append("".join(current).strip())
+        return [chunk for chunk in chunks if chunk] or [""]
+
+    def _split_words(self, sentence):
+        """Split an over-long sentence into chunks on word boundaries."""
+        chunks = []
+        current = []
+        current_tokens = 0
+        for word in sentence.split():
+            word_tokens = self.count_tokens(word)
+            if word_tokens > self.token_limit:
+                # A single word over the limit (e.g. an OCR run without spaces): split it by characters
+                if current:
+                    chunks.append(" ".join(current))
+                    current, current_tokens = [], 0
+                chunks.extend(self._split_characters(word))
+                continue
+            if current and current_tokens + word_tokens > self.token_limit:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += word_tokens
+        if current:
+            chunks.append(" ".join(current))
+        return chunks
+
+    def _split_characters(self, word):
+        """Split an over-long word into the longest runs of characters that fit the limit."""
+        chunks = []
+        while word:
+            low, high = 1, len(word)  # Binary search for the longest prefix within the limit
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.count_tokens(word[:middle]) <= self.token_limit:
+                    low = middle
+                else:
+                    high = middle - 1
+            chunks.append(word[:low])
+            word = word[low:]
+        return chunks
@@ -0,0 +1,11 @@
+import csv
+
+CSV_FILE = "00_courtbooks_to_get.csv"  # Court books to process: IDs in the first column, under a header row
+
+
+def read_court_book_ids(csv_file=CSV_FILE):
+    """Reads the list of court book IDs from the CSV file (first column, header skipped)."""
+    with open(csv_file, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Skip header
+        return [row[0].strip() for row in reader if row and row[0].strip()]
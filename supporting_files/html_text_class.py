@@ -0,0 +1,129 @@
+from html import unescape
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree  # Optional: C parser, used when installed
+except ImportError:
+    etree = None
+
+SKIPPED_TAGS = {"script", "style", "template"}
+FIRST_LINE_LENGTH = 80
+
+
+class _TextCollector:
+    """Parser target that gathers text, the first non-empty <p> and a word count as the HTML streams past."""
+
+    def __init__(self):
+        self.pieces = []
+        self.buffer = []  # Parsers may deliver one text node in several calls; joined before stripping
+        self.paragraph = None  # Stripped strings of the outermost open <p>
+        self.paragraph_depth = 0
+        self.skip_depth = 0
+        self.first_paragraph = None
+
+    def start(self, tag, attrs=None):
+        self._flush()
+        tag = tag.lower()
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "p":
+            if self.paragraph_depth == 0:
+                self.paragraph = []
+            self.paragraph_depth += 1
+
+    def end(self, tag):
+        self._flush()
+        tag = tag.lower()
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "p" and self.paragraph_depth:
+            self.paragraph_depth -= 1
+            if self.paragraph_depth == 0:
+                self._finish_paragraph()
+
+    def data(self, data):
+        if not self.skip_depth:
+            self.buffer.append(data)
+
+    def comment(self, text):
+        self._flush()  # Comments are dropped but still separate the text either side
+
+    def close(self):
+        self._flush()
+        if self.paragraph_depth:
+            self.paragraph_depth = 0
+            self._finish_paragraph()  # Unclosed <p> at the end of the fragment
+        text = unescape(" ".join(self.pieces))
+        return text, self.first_paragraph, len(text.split())
+
+    def _flush(self):
+        stripped = "".join(self.buffer).strip()
+        self.buffer = []
+        if not stripped:
+            return
+        self.pieces.append(stripped)
+        if self.paragraph_depth:
+            self.paragraph.append(stripped)
+
+    def _finish_paragraph(self):
+        if self.first_paragraph is None and self.paragraph:
+            self.first_paragraph = "".join(self.paragraph)
+        self.paragraph = None
+
+
+class _StdlibParser(HTMLParser):
+    """Feeds html.parser events into a _TextCollector."""
+
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag)
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+    def handle_comment(self, data):
+        self.collector.comment(data)
+
+
+class HTMLTextExtractor:
+    """Single-pass HTML to text conversion for entry bodies.
+
+    One parse yields the clean text (same result as BeautifulSoup get_text(separator=" ", strip=True)),
+    the first non-empty paragraph and the word count. Uses lxml's C parser when installed, otherwise
+    the standard library parser; neither builds a document tree.
+    """
+
+    def __init__(self, use_lxml=True):
+        self.use_lxml = use_lxml and etree is not None
+
+    def extract(self, html_content):
+        """Return (text, first paragraph or None, word count) for an HTML string."""
+        if not html_content:
+            return "", None, 0
+        if self.use_lxml:
+            try:
+                parser = etree.HTMLParser(target=_TextCollector())
+                return etree.fromstring(html_content, parser)
+            except (etree.Error, ValueError):
+                pass  # Fall back to the stdlib parser for input lxml rejects
+        parser = _StdlibParser(_TextCollector())
+        parser.feed(html_content)
+        parser.close()
+        return parser.collector.close()
+
+    @staticmethod
+    def first_line(paragraph, max_length=FIRST_LINE_LENGTH):
+        """Truncate a first paragraph for display, or "-" if there was none."""
+        if not paragraph:
+            return "-"
+        return (paragraph[:max_length] + "...") if len(paragraph) > max_length else paragraph
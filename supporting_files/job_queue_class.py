@@ -0,0 +1,183 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LEASE_SECONDS = 600  # A claimed job whose lease isn't renewed for this long is given to another worker
+HEARTBEAT_INTERVAL = 60  # Seconds between lease renewals while a job runs
+MAX_ATTEMPTS = 3  # Claims (including expired leases) before a job is moved to failed/
+RETRY_DELAY = 60  # Seconds before a failed job can be claimed again, multiplied by its attempts so far
+STATES = ("pending", "claimed", "done", "failed")
+
+
+class JobQueue:
+    """Durable court book job queue kept as JSON files in a shared folder, with no server or database.
+
+    Each job is one file that moves between pending/, claimed/, done/ and failed/. A move is an
+    exclusive rename into the queue's private moving/ folder (only one worker's rename can succeed),
+    a rewrite of the record, then a rename into the target folder, so two workers can never both own
+    a job. A claimed job's lease is its file's modified time: the owner touches it every
+    HEARTBEAT_INTERVAL, and any worker returns jobs not touched for LEASE_SECONDS to pending/.
+    Pending jobs are claimed oldest first; a failed job waits RETRY_DELAY per attempt before its retry.
+    """
+
+    def __init__(self, root, worker_id=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.root = root
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        for folder in STATES + ("moving",):
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+
+    def _folder(self, state):
+        return os.path.join(self.root, state)
+
+    def _jobs(self, state):
+        try:
+            names = os.listdir(self._folder(state))
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if name.endswith(".json"))
+
+    @staticmethod
+    def _read(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def _move(self, path, state, update, name=None):
+        """Move a job file to state, applying update(record) on the way. Returns the new path, or None if another worker moved it first."""
+        name = name or os.path.basename(path)
+        moving_path = os.path.join(self._folder("moving"), f"{name}.{self.worker_id}.{uuid.uuid4().hex[:8]}")
+        try:
+            os.utime(path)  # Fresh modified time, so the file isn't mistaken for an abandoned move
+            os.rename(path, moving_path)
+        except FileNotFoundError:
+            return None
+        record = update(self._read(moving_path))
+        with open(moving_path, "w", encoding="utf-8") as file:
+            json.dump(record, file, indent=2)
+        target_path = os.path.join(self._folder(state), name)
+        os.replace(moving_path, target_path)
+        return target_path
+
+    def _owns(self, path):
+        try:
+            return self._read(path).get("worker") == self.worker_id
+        except (OSError, ValueError):
+            return False
+
+    def enqueue(self, court_book_id):
+        """Add a job for a court book unless one is already pending or claimed. Returns True if added."""
+        court_book_id = str(court_book_id)
+        suffix = f"_{court_book_id}.json"
+        if any(name.endswith(suffix) for state in ("pending", "claimed") for name in self._jobs(state)):
+            return False
+        name = f"{time.time_ns()}{suffix}"
+        record = {"court_book_id": court_book_id, "enqueued_at": time.time(), "attempts": 0, "history": []}
+        temp_path = os.path.join(self._folder("moving"), f"{name}.{self.worker_id}.new")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(record, file, indent=2)
+        os.replace(temp_path, os.path.join(self._folder("pending"), name))
+        return True
+
+    def reclaim_expired(self):
+        """Return jobs whose lease has lapsed to pending/ (or failed/ once out of attempts). Returns how many moved."""
+        now = time.time()
+
+        def expire(record):
+            record["history"].append({"at": now, "worker": record.get("worker"), "error": "lease expired"})
+            record.pop("worker", None)
+            return record
+
+        moved = 0
+        for state in ("claimed", "moving"):  # moving/ only holds files mid-move, unless a worker died there
+            for name in os.listdir(self._folder(state)):
+                path = os.path.join(self._folder(state), name)
+                try:
+                    if now - os.path.getmtime(path) <= self.lease_seconds:
+                        continue
+                    record = self._read(path)
+                except (OSError, ValueError):
+                    continue
+                target = "failed" if record.get("attempts", 0) >= self.max_attempts else "pending"
+                job_name = name[:name.index(".json") + len(".json")]
+                if self._move(path, target, expire, name=job_name):
+                    moved += 1
+        return moved
+
+    def claim(self):
+        """Claim the oldest pending job, first returning any expired leases to the queue. Returns (path, record) or None."""
+        self.reclaim_expired()
+
+        def take(record):
+            record["attempts"] = record.get("attempts", 0) + 1
+            record["worker"] = self.worker_id
+            record["claimed_at"] = time.time()
+            return record
+
+        now = time.time()
+        for name in self._jobs("pending"):
+            try:
+                if self._read(os.path.join(self._folder("pending"), name)).get("retry_after", 0) > now:
+                    continue
+            except (OSError, ValueError):
+                continue  # Claimed by another worker in the meantime
+            path = self._move(os.path.join(self._folder("pending"), name), "claimed", take)
+            if path:
+                return path, self._read(path)
+        return None
+
+    def heartbeat(self, path):
+        """Renew the lease on a claimed job. Returns False if the lease was lost to another worker."""
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return self._owns(path)
+
+    def complete(self, path, **result):
+        """Move a claimed job to done/. Returns False if the lease had already been lost."""
+        def finish(record):
+            record.update(result, finished_at=time.time())
+            return record
+
+        return self._owns(path) and self._move(path, "done", finish) is not None
+
+    def fail(self, path, error):
+        """Record a failed attempt: back to pending/ for a retry, or failed/ once out of attempts."""
+        if not self._owns(path):
+            return False
+        attempts = self._read(path).get("attempts", 0)
+
+        def record_failure(record):
+            record["history"].append({"at": time.time(), "worker": self.worker_id, "error": str(error)})
+            record["retry_after"] = time.time() + self.retry_delay * record.get("attempts", 1)
+            record.pop("worker", None)
+            return record
+
+        target = "failed" if attempts >= self.max_attempts else "pending"
+        return self._move(path, target, record_failure) is not None
+
+    @contextmanager
+    def lease(self, path, interval=HEARTBEAT_INTERVAL):
+        """Keep a claimed job's lease alive on a background thread. Yields an Event that is set if the lease is lost."""
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def renew():
+            while not stop.wait(interval):
+                if not self.heartbeat(path):
+                    lost.set()
+                    return
+
+        thread = threading.Thread(target=renew, name="job-lease", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
@@ -3,7 +3,16 @@ import requests
 import warnings
 from urllib3.exceptions import InsecureRequestWarning
 import os
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from supporting_files.throttle_class import TokenBucket, AdaptiveConcurrencyLimiter, RequestThrottle
+from supporting_files.sse_class import SSEDecoder
+from supporting_files.chunker_class import TextChunker
+from supporting_files.metrics_class import METRICS
 
 # Suppress SSL warnings from urllib3
 warnings.simplefilter('ignore', InsecureRequestWarning)
@@ -11,20 +20,83 @@ warnings.simplefilter('ignore', InsecureRequestWarning)
 # Constants
 BASE_URL = 'https://sparkechat.sparke.com.au'
 SECRETS_FILE = "G:/01_Python/Projects/secrets.json"
-RETRY_INTERVAL = 5  # Time in seconds to wait before checking task status
+RETRY_INTERVAL = 5  # Time in seconds to wait before checking task status / retrying a throttled request
+MAX_RETRIES = 3  # Retries for 429/5xx responses and connection errors
+POLL_MAX_INTERVAL = 60  # Upper bound in seconds for the status polling backoff
+BATCH_TIMEOUT = 3600  # Seconds to wait for a batch of async tasks before giving up
+RESULTS_BATCH_SIZE = 50  # Task IDs requested per tasks-results call
+STATUS_POLL_BATCH = 16  # Task statuses checked per polling round; the rest wait for a later round
+STATUS_LOOKUP_FAILURES = 3  # Consecutive failed status lookups (e.g. 404 for an expired task) before a task counts as failed
+FAILED_STATUSES = {"failed", "error", "cancelled"}
+TOKEN_EXPIRY = 100000  # Lifetime in seconds requested for access tokens
+TOKEN_REFRESH_MARGIN = 300  # Refresh a token this many seconds before it expires
 META_PROMPT = "REMEMBER I only want a bullet point list in the response or otherwise say 'I dont' know'"
 
+# Rate and concurrency limits shared by every LLMClient instance
+REQUESTS_PER_SECOND = 5  # Sustained request rate
+REQUEST_BURST = 10  # Requests allowed in a burst above the sustained rate
+INITIAL_CONCURRENCY = 4  # Starting in-flight request limit
+MAX_CONCURRENCY = 16  # Upper bound for the adaptive in-flight limit
+LATENCY_TARGET = 30  # Seconds; slower requests stop the in-flight limit from growing
+
+THROTTLE = RequestThrottle(
+    TokenBucket(rate=REQUESTS_PER_SECOND, capacity=REQUEST_BURST),
+    AdaptiveConcurrencyLimiter(initial_limit=INITIAL_CONCURRENCY, max_limit=MAX_CONCURRENCY, latency_target=LATENCY_TARGET)
+)
+
+# Single keep-alive connection pool shared by every LLMClient instance
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENCY))
+SESSION.verify = False
+
+TOKEN_COUNTER = TextChunker(token_limit=None)  # Only used to count request tokens for metrics
+
+
+class TokenManager:
+    """Caches access tokens per scope and refreshes them lazily when near expiry or rejected."""
+
+    def __init__(self, fetch_token):
+        self.fetch_token = fetch_token  # Callable(sync) -> token or None
+        self.tokens = {}  # sync flag -> (token, expires_at)
+        self.lock = threading.Lock()
+
+    def get(self, sync):
+        """Return a valid token for the scope, requesting a new one only if needed."""
+        with self.lock:
+            cached = self.tokens.get(sync)
+            if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN:
+                return cached[0]
+
+            requested_at = time.time()
+            token = self.fetch_token(sync)
+            if token:
+                self.tokens[sync] = (token, requested_at + TOKEN_EXPIRY)
+            return token
+
+    def invalidate(self, sync, token):
+        """Drop a token the server rejected, unless another thread has already replaced it."""
+        with self.lock:
+            cached = self.tokens.get(sync)
+            if cached and cached[0] == token:
+                del self.tokens[sync]
+
+
 class LLMClient:
-    def __init__(self):
-        """Initialize the LLMClient by loading credentials from .env and retrieving the token."""
+    def __init__(self, cache=None):
+        """Initialize the LLMClient by loading credentials from .env. Tokens are requested on first use.
+
+        cache: optional ResponseCache consulted before any chat request is sent.
+        """
         load_dotenv()  # Load environment variables from .env file
+        self.cache = cache
 
         self.username = os.getenv("BREW_USERNAME")
         self.email = os.getenv("BREW_EMAIL")
         self.password = os.getenv("BREW_PASSWORD")
 
-        self.token_async = self.get_access_token(sync=False)
-        self.token_sync  = self.get_access_token(sync=True)
+        self.tokens = TokenManager(self.get_access_token)
+        self.request_metrics = []  # One dict per streamed chat request (see _parse_chat_response)
+        self.metrics_lock = threading.Lock()
 
     def get_access_token(self, sync=False):
         """Retrieve the access token from the API."""
@@ -32,12 +104,12 @@ class LLMClient:
         params = {
             "tenantID": "sparke",
             "productID": "chat",
-            "expiry": "100000",
+            "expiry": str(TOKEN_EXPIRY),
             "endUserID": self.email,  # Use stored username from secrets file
             "scopes": "summary:sync" if sync else "summary:async"
         }
 
-        response = requests.get(f"{BASE_URL}{endpoint}", params=params, auth=(self.username, self.password), verify=False)
+        response = self._request("GET", f"{BASE_URL}{endpoint}", params=params, auth=(self.username, self.password))
 
         if response.status_code == 200:
             return response.json().get("accessToken")
@@ -48,12 +120,9 @@ class LLMClient:
     def add_document(self, file_name):
         """Add a document and return the upload URL and document ID."""
         endpoint = '/api/v1/chat-summary/documents/'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.token_async}'
-        }
+        headers = {'Content-Type': 'application/json'}
         data = {"fileName": file_name}
-        response = requests.post(f"{BASE_URL}{endpoint}", headers=headers, json=data, verify=False)
+        response = self._request("POST", f"{BASE_URL}{endpoint}", token_scope=False, headers=headers, json=data)
 
         if response.status_code in [200, 201]:
             result = response.json()
@@ -65,22 +134,27 @@ class LLMClient:
     def upload_document(self, upload_url, file_path):
         """Upload the document to the provided upload URL."""
         with open(file_path, "rb") as file:
-            response = requests.put(upload_url, headers={'Content-Type': 'application/pdf'}, data=file, verify=False)
+            response = SESSION.put(upload_url, headers={'Content-Type': 'application/pdf'}, data=file)
             
             if response.status_code == 200:
                 print(f"File '{file_path}' uploaded successfully!")
             else:
                 print(f"File upload failed with status code {response.status_code} - {response.text}")
 
+    def upload_text(self, upload_url, text):
+        """Upload plain text as the document body. Returns True on success."""
+        response = SESSION.put(upload_url, headers={'Content-Type': 'text/plain; charset=utf-8'}, data=text.encode("utf-8"))
+        if response.status_code not in [200, 201]:
+            print(f"Text upload failed with status code {response.status_code} - {response.text}")
+            return False
+        return True
+
     def add_task(self, doc_id, prompt):
         """Create a processing task for the uploaded document."""
         endpoint = '/api/v1/chat-summary/tasks/'
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.token_async}'
-        }
+        headers = {'Content-Type': 'application/json'}
         data = {"docID": doc_id, "prompt": prompt, "meta_prompt": META_PROMPT}
-        response = requests.post(f"{BASE_URL}{endpoint}", headers=headers, json=data, verify=False)
+        response = self._request("POST", f"{BASE_URL}{endpoint}", token_scope=False, headers=headers, json=data)
 
         if response.status_code in [200, 201]:
             return response.json().get('id')
@@ -88,29 +162,77 @@ class LLMClient:
             print(f"Failed to create task: {response.status_code} - {response.text}")
             return None
 
-    def check_task_status(self, task_id, file_name):
-        """Check task status asynchronously."""
+    def get_task_status(self, task_id):
+        """Return the current status of a task, or None if it could not be retrieved."""
         endpoint = f'/api/v1/chat-summary/tasks/{task_id}/status'
-        headers = {'Authorization': f'Bearer {self.token_async}'}
+        response = self._request("GET", f"{BASE_URL}{endpoint}", token_scope=False)
 
-        while True:
-            response = requests.get(f"{BASE_URL}{endpoint}", headers=headers, verify=False)
+        if response.status_code == 200:
+            return response.json().get('status')
+        print(f"Failed to check task status for {task_id}: {response.status_code} - {response.text}")
+        return None
 
-            if response.status_code == 200:
-                status = response.json().get('status')
-                print(f"Current task status: {status} ({file_name})")  
-                if status == "done":
-                    return True
-            else:
-                print(f"Failed to check task status for {file_name}: {response.status_code} - {response.text}")
+    def check_task_status(self, task_id, file_name):
+        """Wait for a task to finish, polling with exponential backoff."""
+        interval = RETRY_INTERVAL
+
+        while True:
+            status = self.get_task_status(task_id)
+            print(f"Current task status: {status} ({file_name})")
+            if status == "done":
+                return True
+            if status is None or status in FAILED_STATUSES:
                 return False
+            time.sleep(interval)
+            interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+    def wait_for_tasks(self, task_ids, timeout=BATCH_TIMEOUT):
+        """Poll pending tasks in rounds of at most STATUS_POLL_BATCH, backing off exponentially between rounds.
+
+        Tasks still running after a round go to the back of the queue, so every task is checked in turn.
+        Returns {task_id: status} where status is 'done', a failure status, 'unavailable' (the status
+        lookup failed STATUS_LOOKUP_FAILURES times in a row) or 'timeout'.
+        """
+        statuses = {}
+        lookup_failures = {}  # task_id -> consecutive failed status lookups
+        pending = list(task_ids)
+        interval = RETRY_INTERVAL
+        deadline = time.monotonic() + timeout
+
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            while pending:
+                polled = pending[:STATUS_POLL_BATCH]
+                round_statuses = dict(zip(polled, executor.map(self.get_task_status, polled)))
+                for task_id, status in round_statuses.items():
+                    lookup_failures[task_id] = lookup_failures.get(task_id, 0) + 1 if status is None else 0
+                    if lookup_failures[task_id] >= STATUS_LOOKUP_FAILURES:
+                        round_statuses[task_id] = "unavailable"
+                finished = [task_id for task_id, status in round_statuses.items()
+                            if status in ("done", "unavailable") or status in FAILED_STATUSES]
+                for task_id in finished:
+                    statuses[task_id] = round_statuses[task_id]
+                pending = pending[len(polled):] + [task_id for task_id in polled if task_id not in statuses]
+
+                print(f"Task status: {len(statuses)} finished, {len(pending)} pending")
+                if not pending:
+                    break
+                if time.monotonic() + interval > deadline:
+                    for task_id in pending:
+                        statuses[task_id] = "timeout"
+                    break
 
+                # Reset the backoff whenever a round makes progress
+                interval = RETRY_INTERVAL if finished else min(interval * 2, POLL_MAX_INTERVAL)
+                time.sleep(interval)
 
-    def get_results(self, task_id):
-        """Retrieve the processed task results."""
-        endpoint = f'/api/v1/chat-summary/tasks-results?taskIDs={task_id}'
-        headers = {'Authorization': f'Bearer {self.token_async}'}
-        response = requests.get(f"{BASE_URL}{endpoint}", headers=headers, verify=False)
+        return statuses
+
+    def get_results(self, task_ids):
+        """Retrieve the processed task results for one task ID or a list of task IDs."""
+        if isinstance(task_ids, (list, tuple, set)):
+            task_ids = ",".join(str(task_id) for task_id in task_ids)
+        endpoint = '/api/v1/chat-summary/tasks-results'
+        response = self._request("GET", f"{BASE_URL}{endpoint}", token_scope=False, params={"taskIDs": task_ids})
 
         if response.status_code == 200:
             return response.json()
@@ -118,39 +240,270 @@ class LLMClient:
             print(f"Failed to retrieve results: {response.status_code} - {response.text}")
             return None
 
-    def send_chat_request(self, text, prompt):
-        """Send a chat request to the LLM endpoint and return only the extracted 'content'."""
-        url = "https://sparkechat.sparke.com.au/api/v1/chat-summary/chat/"
+    @staticmethod
+    def _results_by_task(results):
+        """Map task ID -> result text from a tasks-results payload (a list of results or a dict keyed by task ID)."""
+        if isinstance(results, dict):
+            results = results.get("results", results)
+        if isinstance(results, dict):
+            results = [dict(value, id=key) if isinstance(value, dict) else {"id": key, "result": value}
+                       for key, value in results.items()]
+
+        mapped = {}
+        for item in results or []:
+            if not isinstance(item, dict):
+                continue
+            task_id = item.get("taskID", item.get("id"))
+            text = next((item[key] for key in ("result", "content", "summary", "response") if item.get(key)), None)
+            if task_id is not None and isinstance(text, str):
+                mapped[str(task_id)] = text
+        return mapped
+
+    def _submit_task(self, index, text, prompt):
+        """Upload one entry as a text document and create its task. Returns the task ID or None."""
+        upload_url, doc_id = self.add_document(f"entry_{index}.txt")
+        if not upload_url or not doc_id:
+            return None
+        if not self.upload_text(upload_url, text):
+            return None
+        return self.add_task(doc_id, prompt)
+
+    def run_batch(self, items, bypass_cache=False):
+        """Process (text, prompt) pairs through the async task API and return responses in the same order.
+
+        Cached responses are reused; everything else is submitted as tasks, polled together and
+        fetched in batches of RESULTS_BATCH_SIZE task IDs.
+        """
+        responses = [None] * len(items)
+        cache_keys = [None] * len(items)
+        to_submit = []
+        for index, (text, prompt) in enumerate(items):
+            if self.cache is not None and not bypass_cache:
+                cache_keys[index] = self.cache.make_key(text, prompt, META_PROMPT)
+                responses[index] = self.cache.get(cache_keys[index])
+            if responses[index] is None:
+                to_submit.append(index)
+
+        print(f"Batch mode: {len(items) - len(to_submit)} cached, submitting {len(to_submit)} tasks")
+        for index in to_submit:
+            text, prompt = items[index]
+            METRICS.inc("llm_tokens_in_total", TOKEN_COUNTER.count_tokens(text) + TOKEN_COUNTER.count_tokens(prompt), mode="batch")
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            task_ids = list(executor.map(lambda index: self._submit_task(index, *items[index]), to_submit))
+
+        task_index = {}
+        for index, task_id in zip(to_submit, task_ids):
+            if task_id is None:
+                responses[index] = "Error: Task submission failed"
+            else:
+                task_index[str(task_id)] = index
+
+        statuses = self.wait_for_tasks(list(task_index))
+        done_ids = [task_id for task_id, status in statuses.items() if status == "done"]
+        for task_id, status in statuses.items():
+            if status != "done":
+                responses[task_index[task_id]] = f"Error: Task {status}"
+
+        for start in range(0, len(done_ids), RESULTS_BATCH_SIZE):
+            batch_ids = done_ids[start:start + RESULTS_BATCH_SIZE]
+            results = self._results_by_task(self.get_results(batch_ids))
+            for task_id in batch_ids:
+                index = task_index[task_id]
+                text = results.get(task_id)
+                if text and text.strip():
+                    responses[index] = text.strip()
+                    if cache_keys[index] is not None:
+                        self._cache_put(cache_keys[index], responses[index])
+                else:
+                    responses[index] = "Error: No content extracted"
+
+        for index in to_submit:
+            if responses[index].startswith("Error"):
+                METRICS.inc("llm_errors_total", mode="batch")
+            else:
+                METRICS.inc("llm_tokens_out_total", TOKEN_COUNTER.count_tokens(responses[index]), mode="batch")
+        return responses
+
+    def send_chat_request(self, text, prompt, bypass_cache=False):
+        """Send a chat request to the LLM endpoint and return only the extracted 'content'.
+
+        Cached responses are returned without a network call unless bypass_cache is set.
+        """
+        cache_key = None
+        if self.cache is not None and not bypass_cache:
+            cache_key = self.cache.make_key(text, prompt, META_PROMPT)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        METRICS.inc("llm_tokens_in_total", TOKEN_COUNTER.count_tokens(text) + TOKEN_COUNTER.count_tokens(prompt), mode="chat")
+        response = self._send_chat_request(text, prompt)
+        if response.startswith("Error"):
+            METRICS.inc("llm_errors_total", mode="chat")
+
+        # Only cache real answers so failed requests are retried on the next run
+        if cache_key is not None and not response.startswith("Error"):
+            self._cache_put(cache_key, response)
+        return response
+
+    def _cache_put(self, cache_key, response):
+        """Cache a response; a failed cache write is reported but never loses the response itself."""
+        try:
+            self.cache.put(cache_key, response)
+        except OSError as e:
+            print(f"Could not cache LLM response {cache_key[:12]}: {e}")
+
+    def _send_chat_request(self, text, prompt):
+        """Send the chat request over the network and parse the event stream."""
+        url = f"{BASE_URL}/api/v1/chat-summary/chat/"
         headers = {
             'Content-Type': 'application/json',
-            'Accept': 'text/event-stream',
-            'Authorization': f'Bearer {self.token_sync}'
+            'Accept': 'text/event-stream'
         }
         payload = json.dumps({
             "text": text,
             "prompt": prompt
         })
 
-        response = requests.post(url, headers=headers, data=payload, verify=False, stream=True)
+        # The stream is parsed inside the throttle slot so the request counts as in flight until it finishes
+        handler = partial(self._parse_chat_response, started=time.monotonic())
+        return self._request("POST", url, token_scope=True, headers=headers, data=payload, stream=True, handler=handler)
+
+    def _parse_chat_response(self, response, started):
+        """Extract the 'content' fields from a streamed chat response and record its latency metrics.
 
+        Stops reading as soon as the stream signals completion ([DONE] or a 'done'/'finish_reason' field).
+        time_to_first_token is measured from when the request was queued, so it includes throttle waits
+        and retries; time_to_headers is the server's own response time.
+        """
         if response.status_code != 200:
             return f"Error: {response.status_code} - {response.text}"
 
-        extracted_content = ""  # Store extracted content
+        content_parts = []
+        first_token_at = None
+        decoder = SSEDecoder()
+        finished = False
 
         try:
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode("utf-8").replace("data: ", "")  # Remove 'data:' prefix
-                    try:
-                        json_data = json.loads(line)
-                        if "content" in json_data:  # Only extract 'content' fields
-                            extracted_content += json_data["content"]
-                    except json.JSONDecodeError:
-                        continue  # Ignore lines that aren't valid JSON
+            for chunk in response.iter_content(chunk_size=None):
+                for _, data in decoder.feed(chunk):
+                    finished = self._extract_content(data, content_parts)
+                    if content_parts and first_token_at is None:
+                        first_token_at = time.monotonic()
+                    if finished:
+                        break
+                if finished:
+                    break
+            else:
+                for _, data in decoder.close():
+                    self._extract_content(data, content_parts)
         except requests.RequestException as e:
             return f"Error processing response: {e}"
+        finally:
+            response.close()  # Releases the connection even when stopping early
+
+        finished_at = time.monotonic()
+        generation_time = finished_at - first_token_at if first_token_at is not None else 0.0
+        if first_token_at is not None:
+            METRICS.observe("llm_time_to_first_token_seconds", first_token_at - started)
+        extracted_content = "".join(content_parts)
+        # Same estimate as batch mode, so chat and batch totals compare; stream deltas only drive tokens_per_sec below
+        METRICS.inc("llm_tokens_out_total", TOKEN_COUNTER.count_tokens(extracted_content), mode="chat")
+        with self.metrics_lock:
+            self.request_metrics.append({
+                "time_to_headers": response.elapsed.total_seconds(),
+                "time_to_first_token": (first_token_at - started) if first_token_at is not None else None,
+                "total_time": finished_at - started,
+                "tokens": len(content_parts),  # Each streamed content delta counts as one token
+                "tokens_per_sec": len(content_parts) / generation_time if generation_time > 0 else None,
+            })
 
         return extracted_content.strip() if extracted_content else "Error: No content extracted"
 
+    @staticmethod
+    def _extract_content(data, content_parts):
+        """Append any 'content' in an event's data to content_parts. Returns True once the stream is complete."""
+        if data.strip() == "[DONE]":
+            return True
+        try:
+            payloads = [json.loads(data)]
+        except json.JSONDecodeError:
+            # Some servers put several JSON objects in one event without blank-line separators
+            payloads = []
+            for line in data.split("\n"):
+                try:
+                    payloads.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Ignore lines that aren't valid JSON
+
+        finished = False
+        for json_data in payloads:
+            if not isinstance(json_data, dict):
+                continue
+            if json_data.get("content"):  # Only extract 'content' fields
+                content_parts.append(json_data["content"])
+            if json_data.get("done") is True or json_data.get("finish_reason"):
+                finished = True
+        return finished
+
+    def metrics_summary(self):
+        """Return a one-line summary of streaming latency across this client's chat requests."""
+        with self.metrics_lock:
+            metrics = list(self.request_metrics)
+        if not metrics:
+            return "LLM streaming: no network requests"
+        ttfts = sorted(m["time_to_first_token"] for m in metrics if m["time_to_first_token"] is not None)
+        rates = [m["tokens_per_sec"] for m in metrics if m["tokens_per_sec"] is not None]
+        median_ttft = ttfts[len(ttfts) // 2] if ttfts else 0.0
+        mean_rate = sum(rates) / len(rates) if rates else 0.0
+        mean_headers = sum(m["time_to_headers"] for m in metrics) / len(metrics)
+        return (f"LLM streaming: {len(metrics)} requests, median time to first token {median_ttft:.2f}s, "
+                f"mean time to headers {mean_headers:.2f}s, mean {mean_rate:.1f} tokens/sec")
+
+    def _request(self, method, url, handler=None, token_scope=None, **kwargs):
+        """Send a request over the shared session and rate limiter, retrying throttled (429) and 5xx responses.
+
+        token_scope: True/False adds a bearer token for the sync/async scope; a 401 refreshes it once.
+        Raises PermissionError if no token can be obtained for the scope.
+        If handler is given it is called with the final response while the throttle slot is still held
+        and its return value is returned instead of the response.
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        token = None
+        refreshed = False
+        attempt = 0
+        while True:
+            if token_scope is not None:
+                token = self.tokens.get(token_scope)
+                if not token:
+                    scope = "summary:sync" if token_scope else "summary:async"
+                    raise PermissionError(f"Could not get a {scope} access token; check the BREW_* credentials in .env")
+                headers['Authorization'] = f'Bearer {token}'
+
+            retry_after = None
+            with THROTTLE.slot() as slot:
+                try:
+                    response = SESSION.request(method, url, headers=headers, **kwargs)
+                except requests.RequestException:
+                    if attempt == MAX_RETRIES:
+                        raise
+                else:
+                    slot.status_code = response.status_code
+                    if response.status_code == 401 and token_scope is not None and not refreshed:
+                        response.close()
+                        self.tokens.invalidate(token_scope, token)
+                        refreshed = True
+                        continue  # Retry straight away with a fresh token
+                    if (response.status_code == 429 or response.status_code >= 500) and attempt < MAX_RETRIES:
+                        retry_after = response.headers.get("Retry-After")
+                        response.close()
+                    else:
+                        return handler(response) if handler else response
 
+            THROTTLE.record_retry()
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = RETRY_INTERVAL * (2 ** attempt)
+            attempt += 1
+            time.sleep(delay)
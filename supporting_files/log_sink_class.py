@@ -0,0 +1,97 @@
+import atexit
+import queue
+import sys
+import threading
+import time
+
+FLUSH_INTERVAL = 1.0  # Seconds a line may wait in the buffer before it is written
+MAX_PENDING_LINES = 500  # Write early once this many lines are buffered
+MAX_PENDING_BYTES = 256 * 1024  # ... or this much text
+
+
+class LogSink:
+    """Queue-based, batched appender for log files shared by every stage in the process.
+
+    Callers only put lines on a queue; a background thread groups them by file and appends each group
+    with a single open/write, every FLUSH_INTERVAL seconds or sooner once the size thresholds are hit.
+    This keeps per-message opens of files on the network share out of the stages' loops. Lines keep
+    their order per file, and everything buffered is written at exit or on flush().
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_lines=MAX_PENDING_LINES, max_bytes=MAX_PENDING_BYTES):
+        self.flush_interval = flush_interval
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, path, text, newline=None):
+        """Queue text to be appended to path. newline is passed to open() ("" for csv module output)."""
+        self._ensure_started()
+        self.queue.put((path, newline, text))
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far has been written."""
+        if self.thread is None:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Write anything still buffered and stop the background thread."""
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+
+    def _ensure_started(self):
+        if self.thread is not None:
+            return
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        pending = {}  # (path, newline) -> [text, ...] in arrival order
+        pending_lines = 0
+        pending_bytes = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()  # Interval elapsed
+
+            if isinstance(item, tuple) and item:
+                path, newline, text = item
+                pending.setdefault((path, newline), []).append(text)
+                pending_lines += 1
+                pending_bytes += len(text)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if pending_lines < self.max_lines and pending_bytes < self.max_bytes:
+                    continue
+
+            self._write(pending)
+            pending, pending_lines, pending_bytes, deadline = {}, 0, 0, None
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    @staticmethod
+    def _write(pending):
+        for (path, newline), texts in pending.items():
+            try:
+                with open(path, "a", encoding="utf-8", newline=newline) as f:
+                    f.write("".join(texts))
+            except OSError as e:
+                print(f"Log sink could not write {len(texts)} lines to {path}: {e}", file=sys.stderr)
+
+
+LOG_SINK = LogSink()  # Shared by every stage in the process
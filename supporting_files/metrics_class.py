@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # Seconds
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsRegistry:
+    """Run-wide counters, gauges, histograms and timed spans, shared by every stage of a run.
+
+    Metrics are keyed by name and labels (e.g. stage="02", book="1234"). At the end of a run
+    they are written as JSON lines (spans as they happened, then a snapshot of every metric) and in
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, run_id=None):
+        """Clear all metrics and start a new run."""
+        with self.lock:
+            self.run_id = run_id or time.strftime("%Y%m%d_%H%M%S")
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.events = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def event(self, name, **fields):
+        """Record a one-off structured event (written to the JSON lines file in order)."""
+        with self.lock:
+            self.events.append({"ts": time.time(), "run_id": self.run_id, "event": name, **fields})
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Time a block: observed into histogram name and recorded as a span event, with its outcome."""
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.observe(name, duration, **labels)
+            self.event(name, duration=round(duration, 4), status=status, **labels)
+
+    def snapshot(self):
+        """Return every metric as a list of JSON-serialisable dicts."""
+        with self.lock:
+            lines = [{"type": "counter", "name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in self.counters.items()]
+            lines += [{"type": "gauge", "name": name, "labels": dict(labels), "value": value}
+                      for (name, labels), value in self.gauges.items()]
+            lines += [{"type": "histogram", "name": name, "labels": dict(labels), "count": histogram.count,
+                       "sum": round(histogram.sum, 6), "buckets": dict(zip(map(str, histogram.buckets), histogram.counts))}
+                      for (name, labels), histogram in self.histograms.items()]
+        return lines
+
+    def write_json_lines(self, path):
+        """Append this run's events and a snapshot of every metric to a JSON lines file."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.lock:
+            events = list(self.events)
+        snapshot_time = time.time()
+        with open(path, "a", encoding="utf-8") as f:
+            for record in events:
+                f.write(json.dumps(record, default=str) + "\n")
+            for record in self.snapshot():
+                f.write(json.dumps({"ts": snapshot_time, "run_id": self.run_id, **record}, default=str) + "\n")
+
+    def prometheus_text(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in metrics}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric_name, labels), value in sorted(metrics.items()):
+                        if metric_name == name:
+                            lines.append(f"{name}{self._labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{self._labels(labels + (('le', str(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text file atomically (safe for a textfile collector to read at any time)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (
+            (key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+            for key, value in labels
+        )
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+METRICS = MetricsRegistry()  # Shared by every stage in the process
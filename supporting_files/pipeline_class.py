@@ -0,0 +1,66 @@
+import time
+import concurrent.futures
+from supporting_files.metrics_class import METRICS
+
+
+class BookPipeline:
+    """Moves each court book through a sequence of stages independently of the other books.
+
+    stages is a list of (name, func, workers). func(court_book_id, previous) is called with the book's
+    result from the previous stage (None for the first) and its return value is handed to the next
+    stage. Each stage has its own pool of workers, so book B can be extracting while book A is with
+    the LLM. A book whose stage raises drops out of the pipeline; the other books carry on.
+    """
+
+    def __init__(self, stages, log=print):
+        self.stages = stages
+        self.log = log
+
+    def _run_stage(self, index, court_book_id, previous, queued_at):
+        name, func, _ = self.stages[index]
+        METRICS.observe("pipeline_queue_seconds", time.perf_counter() - queued_at, stage=name)
+        self.log(f"{court_book_id}: {name} started")
+        start = time.perf_counter()
+        with METRICS.timer("pipeline_stage_seconds", stage=name, book=court_book_id):
+            result = func(court_book_id, previous)
+        self.log(f"{court_book_id}: {name} finished in {time.perf_counter() - start:.1f}s")
+        return result
+
+    def run(self, court_book_ids):
+        """Runs every book through every stage. Returns ({court_book_id: final result}, {court_book_id: (stage, error)})."""
+        executors = [
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+            for name, _, workers in self.stages
+        ]
+        pending = {}  # future -> (stage index, court_book_id)
+        results, failures = {}, {}
+
+        def submit(index, court_book_id, previous):
+            future = executors[index].submit(self._run_stage, index, court_book_id, previous, time.perf_counter())
+            pending[future] = (index, court_book_id)
+
+        try:
+            for court_book_id in court_book_ids:
+                submit(0, court_book_id, None)
+
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, court_book_id = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        name = self.stages[index][0]
+                        failures[court_book_id] = (name, e)
+                        METRICS.inc("book_errors_total", stage=name, book=court_book_id, reason="error")
+                        self.log(f"❌ ERROR: {court_book_id}: {name} failed: {e}")
+                        continue
+                    if index + 1 < len(self.stages):
+                        submit(index + 1, court_book_id, result)
+                    else:
+                        results[court_book_id] = result
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+        return results, failures
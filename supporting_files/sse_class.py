@@ -0,0 +1,62 @@
+class SSEDecoder:
+    """Incremental Server-Sent Events decoder.
+
+    Accepts the byte stream in arbitrary chunks (events and lines may be split across chunks)
+    and yields (event_type, data) once each event is complete. Multi-line data fields are
+    joined with newlines as per the SSE specification.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.data_lines = []
+        self.event_type = None
+
+    def feed(self, chunk):
+        """Add a chunk of bytes and yield every event it completes."""
+        self.buffer += chunk
+        lines = self.buffer.splitlines(keepends=True)
+
+        # Hold back an unterminated line, and a trailing CR that may be the first half of a CRLF
+        self.buffer = b""
+        if lines and (not lines[-1].endswith((b"\n", b"\r")) or lines[-1].endswith(b"\r")):
+            self.buffer = lines.pop()
+
+        for line in lines:
+            event = self._process_line(line.rstrip(b"\r\n"))
+            if event is not None:
+                yield event
+
+    def close(self):
+        """Flush any remaining data at the end of the stream (servers do not always send a final blank line)."""
+        if self.buffer:
+            event = self._process_line(self.buffer.rstrip(b"\r\n"))
+            self.buffer = b""
+            if event is not None:
+                yield event
+        event = self._dispatch()
+        if event is not None:
+            yield event
+
+    def _process_line(self, line):
+        if not line:
+            return self._dispatch()
+        if line.startswith(b":"):
+            return None  # Comment / keep-alive
+
+        field, _, value = line.decode("utf-8", errors="replace").partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "data":
+            self.data_lines.append(value)
+        elif field == "event":
+            self.event_type = value
+        return None
+
+    def _dispatch(self):
+        if not self.data_lines:
+            self.event_type = None
+            return None
+        event = (self.event_type or "message", "\n".join(self.data_lines))
+        self.data_lines = []
+        self.event_type = None
+        return event
@@ -0,0 +1,161 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import pandas as pd
+
+STORE_SUFFIX = "_store.sqlite"
+
+class BookStore:
+    """Per-book SQLite store for the data handed between pipeline stages.
+
+    Tables are written from DataFrames and read back with their original column order and dtypes,
+    so stages no longer round-trip through CSV/XLSX. Raw JSON payloads are kept as named blobs.
+    """
+
+    def __init__(self, location, court_book_id):
+        self.court_book_id = str(court_book_id)
+        self.path = os.path.join(location, f"{self.court_book_id}{STORE_SUFFIX}")
+        os.makedirs(location, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS _columns (table_name TEXT, position INTEGER, column_name TEXT, dtype TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS _blobs (name TEXT PRIMARY KEY, data TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS _journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, row_index INTEGER, record TEXT)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def list_books(location):
+        """Return the court book IDs that have a store in location."""
+        stores = glob.glob(os.path.join(location, f"*{STORE_SUFFIX}"))
+        return sorted(os.path.basename(path)[:-len(STORE_SUFFIX)] for path in stores)
+
+    def has_table(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM _columns WHERE table_name = ? LIMIT 1", (name,)).fetchone()
+        return row is not None
+
+    def drop_table(self, name):
+        with self.lock, self.conn:
+            self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self.conn.execute("DELETE FROM _columns WHERE table_name = ?", (name,))
+
+    def write_frame(self, name, df):
+        """Replace table name with the contents of df."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM _columns WHERE table_name = ?", (name,))
+            self.conn.executemany(
+                "INSERT INTO _columns VALUES (?, ?, ?, ?)",
+                [(name, position, str(column), str(dtype)) for position, (column, dtype) in enumerate(df.dtypes.items())]
+            )
+            df.to_sql(name, self.conn, if_exists="replace", index=False)
+
+    def append_frame(self, name, df):
+        """Append df to table name, creating it on first use."""
+        if not self.has_table(name):
+            self.write_frame(name, df)
+            return
+        with self.lock, self.conn:
+            df.to_sql(name, self.conn, if_exists="append", index=False)
+
+    def read_frame(self, name):
+        """Read table name back as a DataFrame with the dtypes it was written with, or None if missing."""
+        with self.lock:
+            columns = self.conn.execute(
+                "SELECT column_name, dtype FROM _columns WHERE table_name = ? ORDER BY position", (name,)
+            ).fetchall()
+            if not columns:
+                return None
+            df = pd.read_sql_query(f'SELECT * FROM "{name}"', self.conn)
+
+        for column, dtype in columns:
+            if column not in df.columns:
+                continue
+            try:
+                if dtype.startswith("datetime64"):
+                    df[column] = pd.to_datetime(df[column])
+                elif dtype == "bool":
+                    df[column] = df[column].astype(bool)
+                elif dtype != "object":
+                    df[column] = df[column].astype(dtype)
+            except (TypeError, ValueError):
+                pass  # Leave as read if the stored values can't take the original dtype (e.g. ints with gaps)
+        return df[[column for column, _ in columns if column in df.columns]]
+
+    def save_json(self, name, data):
+        """Store a JSON-serialisable object under name."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO _blobs VALUES (?, ?)", (name, json.dumps(data, ensure_ascii=False)))
+
+    def load_json(self, name):
+        """Load an object stored with save_json, or None if missing."""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM _blobs WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def journal_append(self, row_index, record):
+        """Append one row's result to the journal and commit it straight away so it survives a crash."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO _journal (row_index, record) VALUES (?, ?)", (int(row_index), json.dumps(record, ensure_ascii=False, default=str)))
+
+    def journal_load(self):
+        """Return {row_index: record} from the journal; later entries for the same row win."""
+        with self.lock:
+            rows = self.conn.execute("SELECT row_index, record FROM _journal ORDER BY seq").fetchall()
+        return {row_index: json.loads(record) for row_index, record in rows}
+
+    def journal_clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM _journal")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class EntryState:
+    """Persistent per-book record of each entry's content hash and last generated part responses, keyed by Line ID.
+
+    Lives outside outputs/ so it survives cleanup; lets later runs skip entries that have not changed.
+    """
+
+    def __init__(self, location, court_book_id):
+        self.location = location
+        self.court_book_id = str(court_book_id)
+
+    @staticmethod
+    def content_hash(entry_original):
+        """Hash of the raw entryOriginal HTML."""
+        return hashlib.sha256((entry_original or "").encode("utf-8")).hexdigest()
+
+    def load(self):
+        """Return {line_id: (content_hash, [part responses])}."""
+        with BookStore(self.location, self.court_book_id) as store:
+            df = store.read_frame("entries")
+        if df is None:
+            return {}
+        return {
+            str(line_id): (content_hash, json.loads(responses))
+            for line_id, content_hash, responses in zip(df["Line ID"], df["Content Hash"], df["Responses"])
+        }
+
+    def update(self, entries):
+        """Merge {line_id: (content_hash, [part responses])} into the stored state."""
+        if not entries:
+            return
+        state = self.load()
+        state.update({str(line_id): value for line_id, value in entries.items()})
+        df = pd.DataFrame(
+            [(line_id, content_hash, json.dumps(responses, ensure_ascii=False)) for line_id, (content_hash, responses) in state.items()],
+            columns=["Line ID", "Content Hash", "Responses"]
+        )
+        with BookStore(self.location, self.court_book_id) as store:
+            store.write_frame("entries", df)
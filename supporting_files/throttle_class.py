@@ -0,0 +1,112 @@
+import threading
+import time
+from contextlib import contextmanager
+from supporting_files.metrics_class import METRICS
+
+class TokenBucket:
+    """Token-bucket rate limiter: allows bursts up to capacity, refilling at rate tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then consume it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: grows by ~1 per window of healthy requests, halves on throttling or server errors."""
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, latency_target=30.0, backoff_factor=0.5, decrease_cooldown=5.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target  # Requests slower than this (seconds) stop the limit growing
+        self.backoff_factor = backoff_factor
+        self.decrease_cooldown = decrease_cooldown  # Only back off once per burst of failures
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until the number of in-flight requests is below the current limit."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, status_code, latency):
+        """Release a slot and adjust the limit from the request outcome (status_code None = connection error)."""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if status_code is None or status_code == 429 or status_code >= 500:
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_factor)
+                    self.last_decrease = now
+            elif latency <= self.latency_target:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RequestSlot:
+    """Outcome of a throttled request, filled in by the caller."""
+
+    def __init__(self):
+        self.status_code = None
+
+
+class RequestThrottle:
+    """Combines a rate limit and an adaptive concurrency limit for all requests to one service."""
+
+    def __init__(self, bucket, limiter, name="llm"):
+        self.bucket = bucket
+        self.limiter = limiter
+        self.name = name  # Metric name prefix
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """Hold a rate-limited concurrency slot for the duration of a request (including streaming the body)."""
+        self.bucket.acquire()
+        self.limiter.acquire()
+        slot = RequestSlot()
+        start = time.monotonic()
+        try:
+            yield slot
+        finally:
+            latency = time.monotonic() - start
+            self.limiter.release(slot.status_code, latency)
+            with self.lock:
+                self.requests += 1
+                if slot.status_code is None or slot.status_code == 429 or slot.status_code >= 500:
+                    self.throttled += 1
+            METRICS.inc(f"{self.name}_requests_total", status=slot.status_code or "error")
+            METRICS.observe(f"{self.name}_request_seconds", latency)
+            METRICS.set(f"{self.name}_concurrency_limit", int(self.limiter.limit))
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+        METRICS.inc(f"{self.name}_retries_total")
+
+    def summary(self):
+        """Return a one-line summary of throttle activity."""
+        return (f"LLM requests: {self.requests} sent, {self.retries} retried, {self.throttled} throttled/failed, "
+                f"concurrency limit now {int(self.limiter.limit)}")
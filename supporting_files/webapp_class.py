@@ -1,8 +1,12 @@
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import os
-from bs4 import BeautifulSoup
-from html import unescape
+from supporting_files.html_text_class import HTMLTextExtractor
+
+POOL_SIZE = 16  # Keep-alive connections so concurrent requests can share the session
+HTML_EXTRACTOR = HTMLTextExtractor()
 
 class APIClient:
     """Reusable API client for handling authentication and API requests."""
@@ -12,6 +16,9 @@ class APIClient:
         self.login_page = login_page
         self.login_url = login_url
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.user, self.password = self.load_credentials()
 
     def load_credentials(self):
@@ -36,13 +43,13 @@ class APIClient:
         response = self.session.post(self.login_url, data=payload, headers=login_headers, allow_redirects=True, timeout=10)
         return response.status_code == 200
 
-    def fetch_api_data(self, endpoint):
+    def fetch_api_data(self, endpoint, timeout=10):
         """Fetch data from the specified API endpoint with better error handling."""
         url = f"{self.base_url}{endpoint}"
         headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
         
         try:
-            response = self.session.get(url, headers=headers, timeout=10)
+            response = self.session.get(url, headers=headers, timeout=timeout)
             
             # Print raw response for debugging
             print(f"API Response (Status {response.status_code})")  
@@ -66,6 +73,49 @@ class APIClient:
             print(f"JSON decode error: Response is not valid JSON. Raw response: {response.text}")
             return None
 
+    def fetch_api_data_with_validators(self, endpoint, validators=None, timeout=10):
+        """Fetch JSON data along with its cache validators (ETag, Last-Modified, content hash).
+
+        If validators from an earlier fetch are given the request is made conditional; a 304 reply
+        returns (None, validators, False). Otherwise returns (data, new validators, changed), where
+        changed compares the content hash with the earlier fetch. data is None on failure.
+        """
+        url = f"{self.base_url}{endpoint}"
+        headers = {"User-Agent": "Mozilla/5.0", "Accept": "application/json"}
+        validators = validators or {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout)
+            print(f"API Response (Status {response.status_code})")
+
+            if response.status_code == 304:
+                return None, validators, False
+            if response.status_code != 200:
+                print(f"API request failed: {response.status_code} - {response.text}")
+                return None, validators, True
+            if not response.text.strip():
+                print("Warning: API response is empty.")
+                return None, validators, True
+
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            new_validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "content_hash": content_hash,
+            }
+            return response.json(), new_validators, content_hash != validators.get("content_hash")
+
+        except requests.exceptions.JSONDecodeError:
+            print(f"JSON decode error: Response is not valid JSON. Raw response: {response.text}")
+            return None, validators, True
+        except requests.exceptions.RequestException as e:
+            print(f"API request error: {e}")
+            return None, validators, True
+
     def send_put_request(self, endpoint, data):
         """Sends a PUT request with JSON data to the specified API endpoint."""
         url = f"{self.base_url}{endpoint}"
@@ -86,13 +136,24 @@ class APIClient:
             print(f"Error sending PUT request: {e}")
             return None
 
+    def put_json(self, endpoint, data, timeout=10, headers=None):
+        """Sends a PUT request with JSON data and returns the response; request errors are raised to the caller."""
+        url = f"{self.base_url}{endpoint}"
+        request_headers = {
+            "User-Agent": "Mozilla/5.0",
+            "Content-Type": "application/json",
+            "Accept": "application/json"
+        }
+        request_headers.update(headers or {})
+        return self.session.put(url, json=data, headers=request_headers, timeout=timeout)
+
     @staticmethod
     def clean_html(html_content):
         """Convert HTML to clean text and ensure a non-empty result."""
-        if not html_content:  # If input is None or empty
-            return ""  
+        text, _, _ = HTML_EXTRACTOR.extract(html_content)
+        return text if text else ""  # Ensure we never return None
 
-        soup = BeautifulSoup(html_content, "html.parser")
-        text = unescape(soup.get_text(separator=" ", strip=True))
-        
-        return text if text else ""  # Ensure we never return None
\ No newline at end of file
+    @staticmethod
+    def extract_html(html_content):
+        """Convert HTML in one parse to (clean text, first non-empty paragraph or None, word count)."""
+        return HTML_EXTRACTOR.extract(html_content)
@@ -0,0 +1,103 @@
+"""Error handling and resume behaviour of stage 2 (02_chronology_generate.py) with a fake chat client."""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from supporting_files.metrics_class import METRICS
+from supporting_files.store_class import BookStore, EntryState
+
+BOOK_ID = "9001"
+GOOD_REPLY = "* The application was adjourned"
+
+
+class FakeChatClient:
+    """Answers chat requests from a script of replies per entry text; unscripted texts get GOOD_REPLY."""
+
+    def __init__(self, replies=None):
+        self.replies = {text: list(script) for text, script in (replies or {}).items()}
+        self.calls = []
+
+    def send_chat_request(self, text, prompt):
+        self.calls.append(text)
+        script = self.replies.get(text)
+        return script.pop(0) if script else GOOD_REPLY
+
+    def metrics_summary(self):
+        return "fake client"
+
+
+@pytest.fixture
+def generate(tmp_path, monkeypatch):
+    """Stage 2 imported with its outputs, state and cache folders under tmp_path."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("outputs", exist_ok=True)
+    spec = importlib.util.spec_from_file_location("chronology_generate", os.path.join(ROOT, "02_chronology_generate.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "STATE_LOCATION", str(tmp_path / "state"))
+    monkeypatch.setattr(module, "SUPPORT_LOCATION", f"{tmp_path}/")
+    pd.DataFrame({"prompt_id": [1], "prompt_text": ["Summarise"]}).to_csv(tmp_path / "prompt_list.csv", index=False)
+    return module
+
+
+def write_courtbook(generate, texts):
+    df = pd.DataFrame({
+        "Unique ID": [f"u{index}" for index in range(len(texts))],
+        "Line ID": [f"l{index}" for index in range(len(texts))],
+        "Part": [1] * len(texts),
+        "Entry Date": ["2024-01-01"] * len(texts),
+        "Entry Description": ["Affidavit"] * len(texts),
+        "Entry_Original": texts,
+        "PromptID": [1] * len(texts),
+        "Handwritten": ["false"] * len(texts),
+        "Content Hash": [f"h{index}" for index in range(len(texts))],
+    })
+    with BookStore(generate.OUTPUT_LOCATION, BOOK_ID) as store:
+        store.write_frame("courtbook", df)
+
+
+def run(generate, client):
+    generate.llm_client = client
+    return generate.process_courtbook(BOOK_ID, "prompt_list.csv")
+
+
+def test_error_reply_is_kept_as_an_error(generate):
+    generate.llm_client = FakeChatClient({"first": ["Error: 503 - Service Unavailable"]})
+    assert generate.process_row("first", "Summarise") == "Error: 503 - Service Unavailable"
+
+
+def test_error_reply_is_not_saved_as_entry_state(generate):
+    write_courtbook(generate, ["first", "second"])
+    results = run(generate, FakeChatClient({"second": ["Error: 503 - Service Unavailable"]}))
+
+    assert list(results["Response"]) == [f"AI Summary\n{GOOD_REPLY}", "Error: 503 - Service Unavailable"]
+    state = EntryState(generate.STATE_LOCATION, BOOK_ID).load()
+    assert set(state) == {"l0"}  # The failed entry is asked again next run
+
+
+def test_resume_retries_only_the_failed_row(generate):
+    write_courtbook(generate, ["first", "second", "third"])
+    run(generate, FakeChatClient({"second": ["Error processing response: connection reset"]}))
+
+    resumed = FakeChatClient()
+    results = run(generate, resumed)
+
+    assert resumed.calls == ["second"]
+    assert list(results["Response"]) == [f"AI Summary\n{GOOD_REPLY}"] * 3
+
+
+def test_chat_errors_are_counted(generate):
+    write_courtbook(generate, ["first", "second"])
+    METRICS.reset()
+    generate.main(llm=FakeChatClient({"second": ["Error: No content extracted"]}), court_book_ids=[BOOK_ID])
+
+    assert METRICS.counters[("entry_errors_total", (("book", BOOK_ID), ("stage", "02")))] == 1
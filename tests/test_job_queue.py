@@ -0,0 +1,148 @@
+"""Claim, lease and retry behaviour of the shared job queue (supporting_files/job_queue_class.py)."""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supporting_files.job_queue_class import JobQueue
+
+
+def expire_lease(path, seconds=3600):
+    """Make a claimed job look as if its lease was last renewed `seconds` ago."""
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_enqueue_skips_books_already_queued(tmp_path):
+    queue = JobQueue(str(tmp_path), "w1")
+    assert queue.enqueue("9001")
+    assert not queue.enqueue("9001")
+    queue.claim()
+    assert not queue.enqueue("9001")  # Still claimed
+
+
+def test_only_one_worker_claims_a_job(tmp_path):
+    JobQueue(str(tmp_path), "setup").enqueue("9001")
+    workers = [JobQueue(str(tmp_path), f"w{index}") for index in range(8)]
+    start = threading.Barrier(len(workers))
+    claims = []
+
+    def claim(queue):
+        start.wait()
+        claims.append(queue.claim())
+
+    threads = [threading.Thread(target=claim, args=(queue,)) for queue in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    won = [claim for claim in claims if claim is not None]
+    assert len(won) == 1
+    assert won[0][1]["court_book_id"] == "9001"
+    assert len(os.listdir(tmp_path / "claimed")) == 1
+    assert os.listdir(tmp_path / "moving") == []
+
+
+def test_jobs_are_claimed_oldest_first(tmp_path):
+    queue = JobQueue(str(tmp_path), "w1")
+    for court_book_id in ("3", "1", "2"):
+        queue.enqueue(court_book_id)
+    assert [queue.claim()[1]["court_book_id"] for _ in range(3)] == ["3", "1", "2"]
+    assert queue.claim() is None
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    owner = JobQueue(str(tmp_path), "w1", lease_seconds=60)
+    other = JobQueue(str(tmp_path), "w2", lease_seconds=60)
+    owner.enqueue("9001")
+    path, _ = owner.claim()
+    expire_lease(path, seconds=30)
+    assert owner.heartbeat(path)
+    assert other.reclaim_expired() == 0
+    assert other.claim() is None
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(tmp_path):
+    owner = JobQueue(str(tmp_path), "w1", lease_seconds=60)
+    other = JobQueue(str(tmp_path), "w2", lease_seconds=60)
+    owner.enqueue("9001")
+    path, _ = owner.claim()
+    expire_lease(path)
+
+    new_path, record = other.claim()
+    assert record["worker"] == "w2"
+    assert record["attempts"] == 2
+    assert record["history"][-1]["error"] == "lease expired"
+    assert record["history"][-1]["worker"] == "w1"
+
+    # The original owner has lost the job and can no longer finish or fail it
+    assert not owner.heartbeat(new_path)
+    assert not owner.complete(new_path)
+    assert not owner.fail(new_path, "late failure")
+    assert other.complete(new_path, return_code=0)
+    assert len(os.listdir(tmp_path / "done")) == 1
+
+
+def test_lease_context_reports_a_lost_lease(tmp_path):
+    owner = JobQueue(str(tmp_path), "w1", lease_seconds=60)
+    other = JobQueue(str(tmp_path), "w2", lease_seconds=60)
+    owner.enqueue("9001")
+    path, _ = owner.claim()
+    with owner.lease(path, interval=0.05) as lost:
+        expire_lease(path)
+        other.claim()
+        assert lost.wait(timeout=2)
+
+
+def test_failed_job_waits_for_retry_after(tmp_path):
+    queue = JobQueue(str(tmp_path), "w1", retry_delay=0.2)
+    queue.enqueue("9001")
+    path, _ = queue.claim()
+    assert queue.fail(path, "07_main.py exited with return code 1")
+
+    record = JobQueue._read(str(tmp_path / "pending" / os.path.basename(path)))
+    assert record["retry_after"] > time.time()
+    assert record["history"][-1]["error"] == "07_main.py exited with return code 1"
+    assert "worker" not in record
+    assert queue.claim() is None
+
+    time.sleep(0.25)
+    _, record = queue.claim()
+    assert record["attempts"] == 2
+
+
+def test_job_moves_to_failed_after_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path), "w1", max_attempts=2, retry_delay=0)
+    queue.enqueue("9001")
+    for _ in range(2):
+        path, _ = queue.claim()
+        assert queue.fail(path, "boom")
+    assert os.listdir(tmp_path / "pending") == []
+    failed = os.listdir(tmp_path / "failed")
+    assert len(failed) == 1
+    assert len(JobQueue._read(str(tmp_path / "failed" / failed[0]))["history"]) == 2
+    assert queue.claim() is None
+
+
+def test_expired_lease_on_last_attempt_moves_to_failed(tmp_path):
+    owner = JobQueue(str(tmp_path), "w1", lease_seconds=60, max_attempts=1)
+    owner.enqueue("9001")
+    path, _ = owner.claim()
+    expire_lease(path)
+    assert JobQueue(str(tmp_path), "w2", lease_seconds=60, max_attempts=1).reclaim_expired() == 1
+    assert len(os.listdir(tmp_path / "failed")) == 1
+    assert os.listdir(tmp_path / "claimed") == []
+
+
+def test_abandoned_move_is_returned_to_pending(tmp_path):
+    queue = JobQueue(str(tmp_path), "w1", lease_seconds=60)
+    queue.enqueue("9001")
+    name = os.listdir(tmp_path / "pending")[0]
+    stranded = tmp_path / "moving" / f"{name}.dead-worker.abcd1234"
+    os.rename(tmp_path / "pending" / name, stranded)  # A worker that died mid-move
+    expire_lease(str(stranded))
+    assert queue.reclaim_expired() == 1
+    assert os.listdir(tmp_path / "pending") == [name]
@@ -0,0 +1,94 @@
+"""Size tracking, background eviction and write safety of the LLM response cache (supporting_files/cache_class.py)."""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supporting_files.cache_class import INDEX_FILE, ResponseCache
+
+
+def wait_for_scan(cache):
+    if cache.scan_thread is not None:
+        cache.scan_thread.join(timeout=10)
+
+
+def cached_files(location):
+    return sorted(name for _, _, names in os.walk(location) for name in names if name.endswith(".json") and name != INDEX_FILE)
+
+
+def test_put_and_get(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    key = cache.make_key("text", "prompt", "meta")
+    assert cache.get(key) is None
+    cache.put(key, "* answer")
+    assert cache.get(key) == "* answer"
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith(".tmp")]
+
+
+def test_opening_uses_the_size_index_instead_of_walking(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    wait_for_scan(cache)
+    cache.put(cache.make_key("a", "p", "m"), "x" * 100)
+    cache.save_index()
+
+    monkeypatch.setattr(ResponseCache, "_entries", lambda self: (_ for _ in ()).throw(AssertionError("walked the cache")))
+    reopened = ResponseCache(str(tmp_path))
+    assert reopened.scan_thread is None
+    assert reopened.total_bytes == cache.total_bytes > 0
+
+
+def test_missing_index_is_rebuilt_in_the_background(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    wait_for_scan(cache)
+    cache.put(cache.make_key("a", "p", "m"), "x" * 100)
+    (tmp_path / INDEX_FILE).unlink()
+
+    reopened = ResponseCache(str(tmp_path))
+    wait_for_scan(reopened)
+    with open(tmp_path / INDEX_FILE, encoding="utf-8") as file:
+        assert json.load(file)["total_bytes"] == reopened.total_bytes > 0
+
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1000)
+    wait_for_scan(cache)
+    keys = [cache.make_key(str(index), "p", "m") for index in range(12)]
+    for index, key in enumerate(keys):
+        cache.put(key, "x" * 100)
+        os.utime(cache._path(key), (1000 + index, 1000 + index))  # Oldest first
+        wait_for_scan(cache)
+
+    remaining = cached_files(tmp_path)
+    assert f"{keys[-1]}.json" in remaining
+    assert f"{keys[0]}.json" not in remaining
+    assert cache.total_bytes <= 1000
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path))
+    wait_for_scan(cache)
+
+    def refuse(source, target):
+        raise PermissionError("share unavailable")
+
+    monkeypatch.setattr(os, "replace", refuse)
+    with pytest.raises(OSError):
+        cache.put(cache.make_key("a", "p", "m"), "* answer")
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith(".tmp")]
+
+
+def test_cache_write_failure_keeps_the_llm_response(tmp_path, monkeypatch):
+    pytest.importorskip("requests")
+    pytest.importorskip("dotenv")
+    from supporting_files import llm_class
+
+    cache = ResponseCache(str(tmp_path))
+    wait_for_scan(cache)
+    client = llm_class.LLMClient(cache=cache)
+    monkeypatch.setattr(client, "_send_chat_request", lambda text, prompt: "* answer")
+    monkeypatch.setattr(cache, "put", lambda key, response: (_ for _ in ()).throw(PermissionError("share unavailable")))
+
+    assert client.send_chat_request("text", "prompt") == "* answer"